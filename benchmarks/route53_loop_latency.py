@@ -0,0 +1,79 @@
+"""
+Measures how late the event loop runs a regular timer while Route53 calls
+are in progress, calling a blocking client directly from a coroutine (as the
+agent used to) vs. via the agent's thread pool.
+
+The client is simulated (each call blocks for ROUTE53_CALL_SECS), so no AWS
+credentials are needed. Run from the top of the repo, with it on the path:
+
+    PYTHONPATH=. python benchmarks/route53_loop_latency.py
+"""
+from sdmgr.dns_provider.route53.agent import Route53
+
+import asyncio
+import os
+import statistics
+import time
+
+
+CALLS = int(os.getenv("ROUTE53_CALLS", 40))
+CALL_SECS = float(os.getenv("ROUTE53_CALL_SECS", 0.1))
+TICK_SECS = 0.01
+
+
+class SlowClient:
+    """
+    Stands in for a boto3 client, blocking the calling thread like a
+    network call would.
+    """
+    def get_change(self, Id):
+        time.sleep(CALL_SECS)
+        return {"ChangeInfo": {"Id": Id, "Status": "INSYNC"}}
+
+
+class Data:
+    id = 0
+    label = "benchmark"
+
+
+async def measure(calls):
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.monotonic()
+            await asyncio.sleep(TICK_SECS)
+            lags.append(time.monotonic() - start - TICK_SECS)
+
+    ticking = asyncio.ensure_future(ticker())
+    start = time.monotonic()
+    await calls()
+    elapsed = time.monotonic() - start
+    done = True
+    await ticking
+    return elapsed, lags
+
+
+async def main():
+    agent = Route53(Data(), None)
+    agent.client = SlowClient()
+
+    async def blocking():
+        async def call(i):
+            agent.client.get_change(Id=str(i))
+        await asyncio.gather(*[call(i) for i in range(CALLS)])
+
+    async def pooled():
+        await asyncio.gather(*[agent._call('get_change', Id=str(i)) for i in range(CALLS)])
+
+    for name, calls in (("blocking", blocking), ("thread pool", pooled)):
+        elapsed, lags = await measure(calls)
+        lags = sorted(lags) or [0]
+        print(f"{name:>12}: {CALLS} calls in {elapsed:.2f}s, "
+              f"loop lag median {statistics.median(lags) * 1000:.1f}ms, "
+              f"max {lags[-1] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -1,4 +1,5 @@
 from sdmgr.db import Setting
+from sdmgr.ratelimit import get_budget, budgets
 
 import sdmgr.settings as settings
 
@@ -11,6 +12,26 @@ _logger = logging.getLogger(__name__)
 class BaseAgent():
     _settings_ = []
 
+    # Default limits on requests to the agent's provider: requests a second
+    # (with bursts of up to '_rate_burst_'), and requests in progress at
+    # once. None for no limit. Can be overridden per agent in its settings.
+    # The burst is available straight away unless '_rate_start_full_' is off.
+    _rate_limit_ = None
+    _rate_burst_ = 1
+    _rate_start_full_ = True
+    _max_concurrency_ = None
+
+    _budget_settings_ = [
+        {
+            'key': "rate_limit",
+            'description': "Most requests a second to the provider's API (optional)",
+        },
+        {
+            'key': "max_concurrency",
+            'description': "Most requests in progress at once to the provider's API (optional)",
+        },
+    ]
+
     def __init__(self, data, manager):
         self.id = data.id
         self.label = data.label
@@ -23,11 +44,28 @@ class BaseAgent():
     def _config(self, key: str):
         return self.config[key]
 
+    @property
+    def budget(self):
+        """
+        The agent's share of the outbound request budget registry.
+        """
+        rate = self.config.get("rate_limit") or self._rate_limit_
+        concurrency = self.config.get("max_concurrency") or self._max_concurrency_
+        return get_budget(self.config_id,
+            rate = float(rate) if rate else None,
+            burst = max(self._rate_burst_, 1),
+            concurrency = int(concurrency) if concurrency else None,
+            full = self._rate_start_full_
+        )
+
     async def start(self):
         settings = Setting.objects.filter(config_id = self.config_id)
         for setting in await settings.all():
             self.config[setting.s_key] = setting.s_value
 
+        # Pick up any changes to the agent's limits
+        budgets.pop(self.config_id, None)
+
         await self._load_state()
 
 # Ensure all expected modules are imported/registered...
@@ -52,7 +90,7 @@ async def fetch_available_agents_and_settings():
         return {
             "class": str(cls.__module__),
             "label": cls._label_,
-            "settings": cls._settings_
+            "settings": cls._settings_ + BaseAgent._budget_settings_
         }
 
     return {
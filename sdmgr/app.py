@@ -8,6 +8,8 @@ from sdmgr import settings, manager
 from sdmgr.db import *
 from sdmgr.oauth2 import *
 from sdmgr.agent import *
+from sdmgr.jobs import load_job_handlers
+from sdmgr.jobs.router import runs_in_worker
 
 import signal
 import asyncio
@@ -26,6 +28,7 @@ from sdmgr.waf.router import router as waf_router
 from sdmgr.notifiers.router import router as notifiers_router
 from sdmgr.sites.router import router as sites_router
 from sdmgr.domains.router import router as domains_router
+from sdmgr.jobs.router import router as jobs_router
 
 
 app = FastAPI(
@@ -50,6 +53,8 @@ async def reconcile(user = Depends(get_current_user)):
     """
     Trigger a full reconciliation process. Status events will be logged to the standard log streams for now, but should eventually be routed to a log management system for indexing/searching/monitoring/alerting etc.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return runs_in_worker()
     status = await m.reconcile()
     return JSONResponse({
         "status": status
@@ -66,6 +71,19 @@ async def agents(user = Depends(get_current_user)):
     return JSONResponse(await fetch_available_agents_and_settings())
 
 
+@app.get("/passes")
+async def passes(limit: int = 20, user = Depends(get_current_user)):
+    """
+    Returns the most recent passes of the manager's monitoring loop, newest
+    first, with the number of domains processed, failures and duration of
+    each. Useful for sizing the loop interval.
+    """
+    recent = list(m.passes)[-limit:]
+    return JSONResponse({
+        "passes": [p.serialize() for p in reversed(recent)]
+    })
+
+
 @app.get("/metrics")
 async def metrics():
     """
@@ -101,6 +119,92 @@ async def metrics():
                 output += f"{fullid} {val[type]}\n"
             output += "\n"
 
+        elif id == "check_queue":
+            output += format_metric("check_queue_depth", "Number of domain checks waiting for a worker", "gauge", val['depth'])
+            output += format_metric("check_queue_in_flight", "Number of domain checks currently running", "gauge", val['in_flight'])
+            output += format_metric("check_queue_workers", "Number of domain check workers", "gauge", val['workers'])
+            output += format_metric("check_queue_processed_total", "Count of domain checks completed", "counter", val['processed'])
+            output += format_metric("check_queue_failed_total", "Count of domain checks that raised an exception", "counter", val['failed'])
+
+        elif id == "scheduler":
+            output += format_metric("scheduled_domains", "Count of active domains scheduled for checks", "gauge", val['scheduled'])
+            output += format_metric("overdue_domains", "Count of domains overdue for checks", "gauge", val['overdue'])
+            output += format_metric("max_overdue_seconds", "How long the most overdue domain has been waiting for a check", "gauge", val['max_overdue_seconds'])
+
+        elif id == "leases":
+            output += format_metric("owned_shards", "Count of domain shards leased by this replica", "gauge", val['owned_shards'])
+            output += format_metric("total_shards", "Count of domain shards shared between replicas", "gauge", val['total_shards'])
+            output += format_metric("live_replicas", "Count of manager replicas with a live heartbeat", "gauge", val['live_replicas'])
+
+        elif id == "last_pass":
+            output += format_metric("last_pass_id", "Identifier of the last completed pass of the monitoring loop", "gauge", val['pass_id'])
+            output += format_metric("last_pass_duration_seconds", "Duration of the last completed pass of the monitoring loop", "gauge", val['duration'])
+            output += format_metric("last_pass_domains", "Count of domains queued in the last completed pass", "gauge", val['domains'])
+            output += format_metric("last_pass_failures", "Count of domains with failed checks in the last completed pass", "gauge", val['failures'])
+            output += format_metric("last_pass_skipped_ticks", "Count of monitoring ticks skipped while the last completed pass was running", "gauge", val['skipped_ticks'])
+        elif id == "pass_running":
+            output += format_metric(id, "Whether a pass of the monitoring loop is currently running", "gauge", val)
+
+        elif id == "dns_cache":
+            output += format_metric("dns_cache_hits_total", "Count of DNS lookups answered from the cache", "counter", val['hits'])
+            output += format_metric("dns_cache_negative_hits_total", "Count of DNS lookups answered from cached NXDOMAIN/SERVFAIL failures", "counter", val['negative_hits'])
+            output += format_metric("dns_cache_misses_total", "Count of DNS lookups sent to a resolver", "counter", val['misses'])
+            output += format_metric("dns_cache_combined_total", "Count of DNS lookups combined with an identical lookup in flight", "counter", val['combined'])
+            output += format_metric("dns_cache_entries", "Count of answers held in the DNS cache", "gauge", val['entries'])
+            output += format_metric("dns_cache_hit_rate", "Proportion of DNS lookups not sent to a resolver", "gauge", val['hit_rate'])
+
+        elif id == "dns_probe":
+            output += format_metric("dns_probe_sweeps_total", "Count of DNS sweeps over the domains due for checks", "counter", val['sweeps'])
+            output += format_metric("dns_probe_lookups_total", "Count of DNS lookups made by sweeps", "counter", val['lookups'])
+            output += format_metric("dns_probe_errors_total", "Count of DNS lookups made by sweeps that failed without an answer", "counter", val['errors'])
+            output += format_metric("dns_probe_last_duration_seconds", "Duration of the last DNS sweep", "gauge", val['last_duration'])
+
+        elif id == "dns_agents":
+            descriptions = {
+                "pending_zones": ("Number of zones with record changes waiting to be sent", "gauge"),
+                "pending_changes": ("Number of record changes waiting to be sent", "gauge"),
+                "batches_sent": ("Count of change batches sent", "counter"),
+                "changes_sent": ("Count of record changes sent", "counter"),
+                "polled_changes": ("Number of sent changes waiting to take effect", "gauge"),
+                "completed_changes": ("Count of sent changes that have taken effect", "counter"),
+                "mean_insync_seconds": ("Mean time for sent changes to take effect", "gauge"),
+                "last_insync_seconds": ("Time taken for the last change to take effect", "gauge"),
+                "cached_zones": ("Number of zones with a snapshot of their record sets", "gauge"),
+                "zone_fetches": ("Count of zone record set snapshots fetched", "counter"),
+                "zone_cache_hits": ("Count of record reads served from a zone snapshot", "counter"),
+            }
+            for key, (description, type) in descriptions.items():
+                values = [(label, val[label][key]) for label in val if key in val[label]]
+                if len(values) == 0:
+                    continue
+                output += format_metric_header(f"dns_agent_{key}", description, type)
+                for label, value in values:
+                    fullid = f"sdmgr_dns_agent_{key}" + '{agent="' + label + '"}'
+                    output += f"{fullid} {value}\n"
+                output += "\n"
+
+        elif id == "agent_budgets":
+            descriptions = {
+                "calls": ("Count of requests made to providers", "counter"),
+                "wait_seconds": ("Total time requests waited for the agent's rate/concurrency limits", "counter"),
+                "rejections": ("Count of requests rate limited by providers", "counter"),
+                "retries": ("Count of requests retried after being rate limited", "counter"),
+                "failures": ("Count of requests given up on after being rate limited repeatedly", "counter"),
+            }
+            for key, (description, type) in descriptions.items():
+                output += format_metric_header(f"agent_requests_{key}", description, type)
+                for agent in val:
+                    fullid = f"sdmgr_agent_requests_{key}" + '{agent="' + agent + '"}'
+                    output += f"{fullid} {val[agent][key]}\n"
+                output += "\n"
+
+        elif id == "jobs":
+            output += format_metric_header(id, "Number of background jobs kept (unfinished, or finished within JOB_RETENTION_SECS)", "gauge")
+            for state in val:
+                fullid = "sdmgr_jobs" + '{state="' + state + '"}'
+                output += f"{fullid} {val[state]}\n"
+            output += "\n"
+
     return Response(content=output, media_type="text/plain")
 
 
@@ -112,6 +216,7 @@ app.include_router(hosting_router)
 app.include_router(notifiers_router)
 app.include_router(sites_router)
 app.include_router(domains_router)
+app.include_router(jobs_router)
 
 
 @app.on_event("startup")
@@ -126,18 +231,29 @@ async def startup():
 
     _logger.debug("Loading modules...")
     await load_and_register_agents()
+    load_job_handlers()
 
     _logger.debug("Connecting to database...")
     await database.connect()
 
-    _logger.debug("Running manager...")
-    await m.run()
+    if settings.MANAGER_IN_PROCESS:
+        _logger.debug("Running manager...")
+        await m.run()
+    else:
+        _logger.info("Manager runs in a separate worker process. Serving API only.")
 
 @app.on_event("shutdown")
 async def shutdown(signal = None):
     if signal:
         _logger.info(f"Received signal: {signal}")
 
+    if settings.MANAGER_IN_PROCESS:
+        _logger.info("Releasing shard leases...")
+        try:
+            await m.leases.release_all()
+        except Exception as e:
+            _logger.exception(e)
+
     _logger.info("Disconnecting from database...")
     await database.disconnect()
 
@@ -0,0 +1,88 @@
+import asyncio
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class CheckQueue:
+    """
+    A fixed-size pool of workers consuming a queue of domain checks. Each
+    queued item is given a future, so callers can wait for its result, or
+    wait for everything queued so far to be processed.
+    """
+
+    def __init__(self, handler, worker_count):
+        self.handler = handler
+        self.worker_count = max(1, worker_count)
+        self.queue = None
+        self.workers = []
+        self.pending = {}
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        if len(self.workers) > 0:
+            return
+        _logger.info(f"Starting {self.worker_count} check queue workers...")
+        self.queue = asyncio.Queue()
+        for num in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self._worker(num)))
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def put(self, key, item):
+        """
+        Queue an item to be passed to the handler. If an item with the same
+        key is already waiting or being processed, the future for that item
+        is returned rather than queueing it a second time.
+        """
+        self.start()
+        if key in self.pending:
+            return self.pending[key]
+        future = asyncio.get_event_loop().create_future()
+        self.pending[key] = future
+        self.queue.put_nowait((key, item, future))
+        return future
+
+    async def join(self):
+        """
+        Wait until every item queued so far has been processed.
+        """
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def _worker(self, num):
+        while True:
+            key, item, future = await self.queue.get()
+            self.in_flight += 1
+            try:
+                result = await self.handler(item)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                _logger.exception(e)
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                self.pending.pop(key, None)
+                self.queue.task_done()
+
+    def metrics(self):
+        return {
+            "depth": self.queue.qsize() if self.queue is not None else 0,
+            "in_flight": self.in_flight,
+            "workers": len(self.workers),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
@@ -6,6 +6,9 @@ from fastapi.encoders import jsonable_encoder
 
 from sdmgr import settings
 
+import logging
+_logger = logging.getLogger(__name__)
+
 database = databases.Database(settings.DATABASE_URL)
 metadata = sqlalchemy.MetaData()
 
@@ -53,6 +56,81 @@ class StatusCheck(orm.Model):
         }
 
 
+class Job(orm.Model):
+    __tablename__ = "jobs"
+    __database__ = database
+    __metadata__ = metadata
+
+    _id = orm.Integer(primary_key=True)
+    job_id = orm.String(max_length=32, unique=True)
+    kind = orm.String(max_length=100)
+    params = orm.JSON()
+    description = orm.Text(allow_null=True)
+    idempotency_key = orm.String(max_length=200, allow_null=True, index=True)
+    state = orm.String(max_length=20, index=True)
+    owner = orm.String(max_length=100, allow_null=True)
+    checkpoint = orm.JSON(allow_null=True)
+    attempts = orm.Integer(default=0)
+    createdTime = orm.DateTime()
+    startedTime = orm.DateTime(allow_null=True)
+    endTime = orm.DateTime(allow_null=True)
+    result = orm.JSON(allow_null=True)
+    error = orm.Text(allow_null=True)
+
+    async def serialize(self, full = False):
+        r = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "description": self.description,
+            "state": self.state,
+            "attempts": self.attempts,
+            "createdTime": jsonable_encoder(self.createdTime),
+            "startedTime": jsonable_encoder(self.startedTime),
+            "endTime": jsonable_encoder(self.endTime),
+            "result": self.result,
+            "error": self.error,
+        }
+        if full:
+            r["params"] = self.params
+            r["idempotency_key"] = self.idempotency_key
+            r["owner"] = self.owner
+            r["checkpoint"] = self.checkpoint
+        return r
+
+
+# Files uploaded to API-only processes, stored a chunk per row until a
+# worker's job has read them (orm has no binary field, so this is a plain
+# table)
+job_uploads = sqlalchemy.Table("job_uploads", metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("upload_id", sqlalchemy.String(length=32), index=True),
+    sqlalchemy.Column("seq", sqlalchemy.Integer),
+    sqlalchemy.Column("data", sqlalchemy.LargeBinary),
+    sqlalchemy.Column("createdTime", sqlalchemy.DateTime),
+)
+
+
+class ManagerLease(orm.Model):
+    __tablename__ = "manager_leases"
+    __database__ = database
+    __metadata__ = metadata
+
+    id = orm.Integer(primary_key=True)
+    shard = orm.Integer(unique=True)
+    owner = orm.String(max_length=100, allow_null=True)
+    expires = orm.DateTime(allow_null=True)
+
+
+class ManagerReplica(orm.Model):
+    __tablename__ = "manager_replicas"
+    __database__ = database
+    __metadata__ = metadata
+
+    id = orm.Integer(primary_key=True)
+    owner = orm.String(max_length=100, unique=True)
+    expires = orm.DateTime()
+
+
 class Hosting(orm.Model):
     __tablename__ = "hosting"
     __database__ = database
@@ -173,6 +251,8 @@ class Domain(orm.Model):
     google_site_verification = orm.String(max_length=64, allow_null=True)
     state = orm.Text(default="{}")
     active = orm.Boolean(default=True)
+    next_check_at = orm.DateTime(allow_null=True)
+    check_interval = orm.Integer(allow_null=True)
 
     async def serialize(self, full = False):
         r = {
@@ -224,6 +304,35 @@ class RegistrarNotifier(orm.Model):
     notifier = orm.ForeignKey(Notifier)
 
 
-# Create the database
+def add_missing_columns(engine, metadata):
+    """
+    Add any (nullable) columns missing from existing tables, i.e. columns
+    added to a model since the table was created, which 'create_all'
+    leaves alone. Safe to run on every start.
+    """
+    inspector = sqlalchemy.inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                _logger.warning(f"Column '{table.name}.{column.name}' is missing, and must be added by hand.")
+                continue
+            _logger.info(f"Adding column '{table.name}.{column.name}'...")
+            column_type = column.type.compile(dialect = engine.dialect)
+            try:
+                with engine.connect() as conn:
+                    conn.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+            except sqlalchemy.exc.OperationalError as e:
+                # Another replica probably added it first
+                _logger.warning(f"Could not add column '{table.name}.{column.name}': {e}")
+
+
+# Create the database, and bring existing tables up to date
 engine = sqlalchemy.create_engine(str(database.url))
 metadata.create_all(engine)
+add_missing_columns(engine, metadata)
@@ -0,0 +1,179 @@
+from sdmgr import settings
+from sdmgr.resolver import resolver as shared_resolver
+
+import asyncio
+import random
+import struct
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+TYPE_NS = 2
+CLASS_IN = 1
+
+
+class DelegationLookupException(Exception):
+    pass
+
+
+def build_query(query_id, name, type = TYPE_NS):
+    """
+    A DNS query packet for the name, without recursion desired.
+    """
+    header = struct.pack("!HHHHHH", query_id, 0, 1, 0, 0, 0)
+    # Non-ASCII labels get longer when encoded, so the length is taken after
+    labels = [label.encode("idna") for label in name.rstrip(".").split(".") if len(label) > 0]
+    qname = b"".join(bytes([len(label)]) + label for label in labels) + b"\x00"
+    return header + qname + struct.pack("!HH", type, CLASS_IN)
+
+
+def _read_name(packet, offset):
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(packet):
+            raise DelegationLookupException("Truncated name in DNS response")
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            # Compression pointer to a name elsewhere in the packet
+            if jumps > 20:
+                raise DelegationLookupException("Compression loop in DNS response")
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack("!H", packet[offset:offset + 2])[0] & 0x3FFF
+            jumps += 1
+        elif length == 0:
+            offset += 1
+            break
+        else:
+            labels.append(packet[offset + 1:offset + 1 + length].decode("ascii", errors="replace"))
+            offset += 1 + length
+    return ".".join(labels).lower(), end if end is not None else offset
+
+
+def parse_response(packet, query_id):
+    """
+    Returns the response code, and the (name, type, value) records of the
+    answer and authority sections, with NS values as hostnames.
+    """
+    if len(packet) < 12:
+        raise DelegationLookupException("Short DNS response")
+    (response_id, flags, qdcount, ancount, nscount, arcount) = struct.unpack("!HHHHHH", packet[:12])
+    if response_id != query_id:
+        raise DelegationLookupException("Mismatched DNS response id")
+    if flags & 0x0200:
+        raise DelegationLookupException("Truncated DNS response")
+
+    offset = 12
+    for i in range(qdcount):
+        name, offset = _read_name(packet, offset)
+        offset += 4
+
+    records = []
+    for i in range(ancount + nscount):
+        name, offset = _read_name(packet, offset)
+        (type, cls, ttl, rdlength) = struct.unpack("!HHIH", packet[offset:offset + 10])
+        offset += 10
+        if type == TYPE_NS:
+            value, _ = _read_name(packet, offset)
+        else:
+            value = packet[offset:offset + rdlength]
+        records.append((name, type, value))
+        offset += rdlength
+
+    return flags & 0x000F, records
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+async def query_server(address, port, name, timeout):
+    """
+    Send a single NS query for the name over UDP to the given server, and
+    return the hostnames it delegates the name to.
+    """
+    loop = asyncio.get_event_loop()
+    query_id = random.randint(0, 0xFFFF)
+    future = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _QueryProtocol(future), remote_addr=(address, port))
+    try:
+        transport.sendto(build_query(query_id, name))
+        packet = await asyncio.wait_for(future, timeout)
+    finally:
+        transport.close()
+
+    rcode, records = parse_response(packet, query_id)
+    if rcode != 0:
+        raise DelegationLookupException(f"Server {address} answered with rcode {rcode} for {name}")
+    name = name.lower().rstrip(".")
+    return set(value.rstrip(".") for (owner, type, value) in records
+               if type == TYPE_NS and owner.rstrip(".") == name)
+
+
+class DelegationChecker:
+    """
+    Asks the parent zone's (i.e. TLD's) authoritative servers which
+    nameservers a domain is delegated to. Unlike a recursive lookup this
+    isn't subject to caching, so reflects registrar changes as soon as the
+    registry publishes them. The addresses of the parent servers are cached
+    per parent zone.
+    """
+
+    def __init__(self, resolver, cache_secs, timeout, port = 53):
+        self.resolver = resolver
+        self.cache_secs = cache_secs
+        self.timeout = timeout
+        self.port = port
+        self.parent_servers = {}
+
+    async def get_parent_servers(self, parent):
+        cached = self.parent_servers.get(parent)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        hostnames = await self.resolver.query(parent, 'NS')
+        results = await asyncio.gather(
+            *[self.resolver.query(x, 'A') for x in hostnames], return_exceptions=True)
+        addresses = sorted(set(ip for ips in results if not isinstance(ips, Exception) for ip in ips))
+        if len(addresses) < 1:
+            raise DelegationLookupException(f"No addresses found for the servers of '{parent}'")
+
+        self.parent_servers[parent] = (time.monotonic() + self.cache_secs, addresses)
+        return addresses
+
+    async def get_delegation(self, name):
+        """
+        The nameserver hostnames the parent zone delegates the name to.
+        """
+        name = name.lower().rstrip(".")
+        parent = name.split(".", 1)[1] if "." in name else "."
+        addresses = list(await self.get_parent_servers(parent))
+        random.shuffle(addresses)
+
+        # Fall through the parent's servers until one answers
+        error = None
+        for address in addresses:
+            try:
+                return await query_server(address, self.port, name, self.timeout)
+            except (DelegationLookupException, asyncio.TimeoutError, OSError) as e:
+                _logger.debug(f"Querying {address} for delegation of {name}: {e}")
+                error = e
+        raise DelegationLookupException(f"No servers for '{parent}' answered for {name}: {error}")
+
+
+# Singleton shared by all checks
+delegation = DelegationChecker(shared_resolver, settings.DNS_PARENT_CACHE_SECS, settings.DNS_TIMEOUT)
@@ -1,12 +1,12 @@
-from sdmgr.db import DNSProvider, Domain, Registrar
+from sdmgr.db import database, DNSProvider, Registrar
 from sdmgr.agent import BaseAgent
+from sdmgr.jobs import run_step
+from sdmgr.domains.bulk import fetch_domain_map, insert_domains, update_domains
+from sdmgr import settings
 
 import logging
 _logger = logging.getLogger(__name__)
 
-import json
-import orm
-
 
 class DNSProviderAgent(BaseAgent):
     _agent_type_ = "dns"
@@ -29,28 +29,89 @@ class DNSProviderAgent(BaseAgent):
     async def get_status_for_domain(self, domainname):
         raise NotImplementedError
 
-    async def _populate_domains(self):
+    async def _default_registrar_id(self):
+        """
+        The registrar assumed for domains first found on this provider: the
+        agent's 'default_registrar' setting, or DNS_DEFAULT_REGISTRAR.
+        """
+        return int(self.config.get("default_registrar") or settings.DNS_DEFAULT_REGISTRAR)
+
+    async def _populate_domains(self, domainnames = None):
+        """
+        Make sure the state db has a domain for each of the provider's
+        hosted domains (or the given subset of them), associated with this
+        provider. New and reassigned domains are inserted and updated in
+        bulk in one transaction. Returns counts of domains created, moved
+        and unchanged.
+        """
+        counts = {
+            "created": 0,
+            "moved": 0,
+            "unchanged": 0,
+        }
         try:
             dns = await DNSProvider.objects.get(id = self.id)
-            # HACK: Assume that domain is registered with IONOS
-            ionos = await Registrar.objects.get(id = 3)
-            for domainname in await self.get_hosted_domains():
-                _logger.debug(f"Checking {domainname}...")
-                try:
-                    domain = await Domain.objects.get(name=domainname)
-                    _logger.debug(f"Found {domainname}.")
-                    if domain.dns.id != dns.id:
-                        _logger.info(f"Updating DNS provider for domain {domainname} to {dns.label}.")
-                        await domain.update(dns = dns)
-                except orm.exceptions.NoMatch:
-                    domain = await Domain.objects.create(
-                        name = domainname,
-                        registrar = ionos,
-                        dns = dns,
-                    )
-                    _logger.info(f"Created domain {domainname}...")
+            if domainnames is None:
+                domainnames = await self.get_hosted_domains()
+            domainnames = set(domainnames)
+
+            existing = await fetch_domain_map(domainnames, "dns")
+            created = [x for x in domainnames if x not in existing]
+            moved = [existing[x][0] for x in domainnames if x in existing and existing[x][1] != dns.id]
+
+            registrar_id = None
+            if len(created) > 0:
+                registrar = await Registrar.objects.get(id = await self._default_registrar_id())
+                registrar_id = registrar.id
+
+            async with database.transaction():
+                await insert_domains(created, registrar = registrar_id, dns = dns.id)
+                await update_domains(moved, dns = dns.id)
+
+            counts["created"] = len(created)
+            counts["moved"] = len(moved)
+            counts["unchanged"] = len(domainnames) - len(created) - len(moved)
+            _logger.info(f"Created {counts['created']}, moved {counts['moved']} and found {counts['unchanged']} unchanged domains from DNS provider '{dns.label}'.")
         except Exception as e:
             _logger.exception(e)
+        return counts
+
+    async def _populate_domain(self, domainname):
+        """
+        Record a domain hosted by this agent in the state db, i.e. after a
+        new zone is created. Only that domain's row is read and written.
+        """
+        return await self._populate_domains([domainname])
+
+    async def create_domain(self, domainname):
+        raise NotImplementedError
+
+    async def create_domains(self, domainnames):
+        """
+        Create zones for several domains. Agents able to create zones
+        concurrently should override this.
+        """
+        for domainname in domainnames:
+            await run_step(f"zone:{domainname}", self.create_domain, domainname)
+
+    def metrics(self):
+        """
+        Agent specific metrics (i.e. pending changes), keyed by name.
+        """
+        return {}
+
+    def forget_cached_records(self, domainname):
+        """
+        Drop any records cached for the domain, so they're fetched afresh
+        when next needed. Returns whether there were any to drop.
+        """
+        return False
+
+    async def wait_for_change(self, change_id):
+        """
+        Wait for a change previously submitted to the provider to take effect.
+        """
+        raise NotImplementedError
 
     async def check_google_site_verification(self, domain):
         raise NotImplementedError
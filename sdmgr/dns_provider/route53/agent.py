@@ -1,12 +1,33 @@
 from ..base import DNSProviderAgent
 from .. import DomainNotHostedException
+from .changes import ZoneChangeBatcher
+from .poller import ChangePoller
+from .records import ZoneRecordCache, record_key
+from sdmgr.jobs import save_checkpoint, run_step
+from sdmgr import settings
+from sdmgr.ratelimit import RateLimitedException
 
 import logging
 _logger = logging.getLogger(__name__)
 
 import asyncio
+import concurrent.futures
+import functools
 import uuid
 import boto3
+import botocore.exceptions
+
+
+# Errors returned when we exceed Route53's request rate
+THROTTLING_ERRORS = ("Throttling", "ThrottlingException", "PriorRequestNotComplete")
+
+
+def zone_id_of(zone):
+    # i.e. '/hostedzone/Z1D633PJN98FT9' -> 'Z1D633PJN98FT9'
+    return zone['Id'].split('/')[-1]
+
+def build_zone_id_index(domains):
+    return {name: zone_id_of(zone) for name, zone in domains.items()}
 
 
 class Route53(DNSProviderAgent):
@@ -21,14 +42,37 @@ class Route53(DNSProviderAgent):
             'key': "aws_secret_access_key",
             'description': "AWS secret access key",
         },
+        {
+            'key': "default_registrar",
+            'description': "Id of the registrar assumed for new domains found on Route53 (optional)",
+        },
     ]
 
+    # Route53 allows 5 requests a second per account
+    _rate_limit_ = 5
+    _rate_burst_ = 5
+    _max_concurrency_ = settings.ROUTE53_MAX_IN_FLIGHT
+
     def __init__(self, data, manager):
         _logger.info(f"Loading Route53 DNS provider agent (id: {data.id}): {data.label})")
         DNSProviderAgent.__init__(self, data, manager)
 
         self.domains = {}
-        self.zone_ids_cache = {}
+        self.zone_ids = {}
+
+        # One client for the agent, called from a small pool of threads so
+        # that the (blocking) calls don't hold up the event loop. Calls in
+        # progress are limited by the agent's budget.
+        self.client = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = settings.ROUTE53_MAX_IN_FLIGHT,
+            thread_name_prefix = f"route53-{data.id}"
+        )
+
+        # Record changes to each zone are sent together
+        self.changes = ZoneChangeBatcher(self, settings.ROUTE53_FLUSH_SECS)
+        self.poller = ChangePoller(self, settings.ROUTE53_POLL_SECS, settings.ROUTE53_POLL_MAX_SECS)
+        self.records = ZoneRecordCache(self, settings.ROUTE53_SNAPSHOT_SECS)
 
     async def _load_state(self):
         await super(Route53, self)._load_state()
@@ -38,53 +82,87 @@ class Route53(DNSProviderAgent):
         except KeyError:
             self.domains = {}
             _logger.info(f"Initialiased state for {self.label}.")
+        self.zone_ids = self.state.get('zone_ids') or build_zone_id_index(self.domains)
 
     async def _save_state(self):
         self.state = {
-            "domains": self.domains
+            "domains": self.domains,
+            "zone_ids": self.zone_ids,
         }
         await super(Route53, self)._save_state()
 
     def get_client(self):
-        return boto3.client('route53',
-            aws_access_key_id = self._config("aws_access_key_id"),
-            aws_secret_access_key = self._config("aws_secret_access_key")
-        )
+        # boto3 clients are thread safe, so one is shared by all calls
+        if self.client is None:
+            self.client = boto3.client('route53',
+                aws_access_key_id = self._config("aws_access_key_id"),
+                aws_secret_access_key = self._config("aws_secret_access_key")
+            )
+        return self.client
 
-    def _get_zone_id_for_domain(self, domainname):
-        if domainname in self.zone_ids_cache.keys():
-            return self.zone_ids_cache[domainname]
-        client = self.get_client()
-        zones = client.list_hosted_zones_by_name(DNSName=domainname)
-        if not zones or len(zones['HostedZones']) == 0:
-            raise DomainNotHostedException(domainname)
+    async def _call(self, method, **kwargs):
+        """
+        Call a Route53 API method in the agent's thread pool, within the
+        agent's budget (by default ROUTE53_MAX_IN_FLIGHT calls in progress
+        at once), retrying calls that are throttled.
+        """
+        return await self.budget.call(self._call_once, method, **kwargs)
+
+    async def _call_once(self, method, **kwargs):
+        func = getattr(self.get_client(), method)
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(func, **kwargs))
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in THROTTLING_ERRORS:
+                raise RateLimitedException(str(e))
+            raise
 
-        zone_id = zones['HostedZones'][0]['Id'][12:]
-        self.zone_ids_cache[domainname] = zone_id
-        return zone_id
+    async def _get_zone_id_for_domain(self, domainname):
+        # The index is rebuilt by each refresh, and updated as zones are
+        # created, so a zone missing from it isn't hosted with us
+        try:
+            return self.zone_ids[domainname.strip('.')]
+        except KeyError:
+            raise DomainNotHostedException(domainname)
 
     async def _wait_for_change_id(self, change_id):
-        client = self.get_client()
-        while True:
-            _logger.debug(f"Polling change id '{change_id}'")
-            response = client.get_change(Id=change_id)
-            try:
-                #status = response["GetChangeResponse"]["ChangeInfo"]["Status"]
-                status = response["ChangeInfo"]["Status"]
-                _logger.debug(f"Found status for {change_id}: {status}")
-                if status == "INSYNC":
-                    break
-                await asyncio.sleep(5)
-            except KeyError:
-                _logger.error(f"Unexpected response: {response}")
-                break
+        # Note the change, in case we're interrupted while waiting for it.
+        # A job may wait for several changes at once, so each has its own key.
+        key = f"pending_change:{change_id}"
+        await save_checkpoint(**{key: {
+            "dns_agent": self.id,
+            "change_id": change_id
+        }})
+
+        await self.poller.wait(change_id)
+
+        await save_checkpoint(**{key: None})
+
+    async def wait_for_change(self, change_id):
+        await self._wait_for_change_id(change_id)
+
+    def forget_cached_records(self, domainname):
+        # Refresh only notices outside changes that alter the number of
+        # record sets, so checks that fail against a snapshot refetch it
+        zone_id = self.zone_ids.get(domainname.strip('.'))
+        if zone_id is None or zone_id not in self.records.zones:
+            return False
+        self.records.invalidate(zone_id)
+        return True
+
+    def metrics(self):
+        return {
+            **self.changes.metrics(),
+            **self.poller.metrics(),
+            **self.records.metrics(),
+        }
 
     async def refresh(self):
         _logger.info(f"Refreshing list of domains managed on {self.label}...")
         domains = {}
         marker = None
 
-        client = self.get_client()
         while True:
             _logger.debug(f"Fetching page of results from Route53...")
             kwargs = {
@@ -92,7 +170,7 @@ class Route53(DNSProviderAgent):
             }
             if marker is not None:
                 kwargs['Marker'] = marker
-            response = client.list_hosted_zones(**kwargs)
+            response = await self._call('list_hosted_zones', **kwargs)
             for zone in response['HostedZones']:
                 dname = zone['Name'].strip('.')
                 domains[dname] = zone
@@ -100,11 +178,23 @@ class Route53(DNSProviderAgent):
                 break
             marker = response['NextMarker']
 
+        # Zones whose number of record sets has changed have been changed
+        # by someone else, so their snapshots need fetching again
+        for name, zone in domains.items():
+            previous = self.domains.get(name)
+            if previous is None or previous.get('ResourceRecordSetCount') != zone.get('ResourceRecordSetCount'):
+                self.records.invalidate(zone_id_of(zone))
+
         self.domains = domains
+        self.zone_ids = build_zone_id_index(domains)
         _logger.info(f"Loaded {len(self.domains)} domains from Route53 API.")
         await self._save_state()
 
-        await self._populate_domains()
+        counts = await self._populate_domains()
+        return {
+            "count": len(self.domains),
+            **counts
+        }
 
     async def get_hosted_domains(self):
         return self.domains.keys()
@@ -114,37 +204,57 @@ class Route53(DNSProviderAgent):
             return {
                 'summary': f"No information for '{domainname}'"
             }
-        zone_id = self._get_zone_id_for_domain(domainname)
+        zone_id = await self._get_zone_id_for_domain(domainname)
         return {
             'name': domainname,
             'summary': f"OK (R53 Zone: {zone_id})",
             'nameservers': await self.get_ns_records(domainname),
         }
 
+    async def get_record_values(self, domainname, type, hostname = None):
+        """
+        The values of a record set in the domain's zone (the apex, unless a
+        hostname is given), read from the zone's snapshot.
+        """
+        zone_id = await self._get_zone_id_for_domain(domainname)
+        records = await self.records.get(zone_id)
+        record_set = records.get(record_key(hostname or domainname, type))
+        if record_set is None:
+            return []
+        return [x['Value'] for x in record_set.get('ResourceRecords', [])]
+
+    async def diff_zone(self, domainname, desired):
+        """
+        The changes needed for the domain's zone to have the desired record
+        sets, and the keys of other record sets found in the zone.
+        """
+        zone_id = await self._get_zone_id_for_domain(domainname)
+        return await self.records.diff(zone_id, desired)
+
     async def get_ns_records(self, domainname):
-        zone_id = self._get_zone_id_for_domain(domainname)
-        client = self.get_client()
-        response = client.list_resource_record_sets(
-            HostedZoneId=zone_id,
-            StartRecordType='NS',
-            StartRecordName=domainname,
-            MaxItems='1'
-        )
-        rrs = response['ResourceRecordSets']
-        values = []
-        if len(rrs) > 0:
-            if rrs[0]['Type'] == 'NS' and rrs[0]['Name'] == f"{domainname}.":
-                values = [x['Value'].strip(".") for x in rrs[0]['ResourceRecords']]
-        return values
-
-    async def create_domain(self, domain):
+        return [x.strip(".") for x in await self.get_record_values(domainname, 'NS')]
+
+    async def create_domain(self, domain, save_state = True):
+        domain = domain.strip('.')
         if domain in self.domains.keys():
             _logger.info(f"Domain {domain} already hosted by {self.label}. No need to create again.")
             return
 
-        client = self.get_client()
+        # The index is only as fresh as the last refresh, and Route53 allows
+        # several zones with the same name, so adopt any zone created
+        # elsewhere since rather than create a duplicate
+        existing = await self._find_zone_by_name(domain)
+        if existing is not None:
+            _logger.info(f"Found existing zone for {domain} on {self.label}. Adopting it.")
+            self.domains[domain] = existing
+            self.zone_ids[domain] = zone_id_of(existing)
+            if save_state:
+                await self._save_state()
+            await self._populate_domain(domain)
+            return
+
         token = uuid.uuid4().__str__().replace("-", "")
-        response = client.create_hosted_zone(
+        response = await self._call('create_hosted_zone',
             Name=domain,
             CallerReference=token,
             HostedZoneConfig={
@@ -153,58 +263,56 @@ class Route53(DNSProviderAgent):
             }
         )
 
+        # Add the new zone to our list and index, and the state db, rather
+        # than refreshing the whole list
+        self.domains[domain] = response['HostedZone']
+        self.zone_ids[domain] = zone_id_of(response['HostedZone'])
+        if save_state:
+            await self._save_state()
+        await self._populate_domain(domain)
+
         await self._wait_for_change_id(response['ChangeInfo']['Id'])
 
-        # Let the domain settle before using it...
-        await asyncio.sleep(5)
+    async def _find_zone_by_name(self, domain):
+        response = await self._call('list_hosted_zones_by_name', DNSName = domain, MaxItems = "1")
+        for zone in response['HostedZones']:
+            if zone['Name'].strip('.') == domain:
+                return zone
+        return None
+
+    async def create_domains(self, domainnames):
+        # Create several zones at once, so the waits for each to go INSYNC
+        # overlap
+        semaphore = asyncio.Semaphore(settings.ROUTE53_MAX_ZONE_CREATES)
+
+        async def create(domainname):
+            async with semaphore:
+                await run_step(f"zone:{domainname}", self.create_domain, domainname, False)
 
-        # Refresh our list of domains
-        await self.refresh()
+        # The agent's state is saved once for the batch, rather than for
+        # each zone
+        try:
+            await asyncio.gather(*[create(x) for x in domainnames])
+        finally:
+            await self._save_state()
 
     async def create_new_a_rr(self, domain, hostname, ip_addrs):
-        zone_id = self._get_zone_id_for_domain(domain.name)
-        print(zone_id)
-        client = self.get_client()
-        response = client.change_resource_record_sets(
-            HostedZoneId=zone_id,
-            ChangeBatch={
-                'Comment': f"SDMGR setting {len(ip_addrs)} A record(s)",
-                'Changes': [
-                    {
-                        'Action': 'UPSERT',
-                        'ResourceRecordSet': {
-                            'Name': hostname,
-                            'Type': 'A',
-                            'TTL': 300,
-                            'ResourceRecords': [
-                                {
-                                    'Value': x
-                                } for x in ip_addrs
-                            ],
-                        }
-                    },
-                ]
-            }
-        )
-        print(response)
-        await self._wait_for_change_id(response['ChangeInfo']['Id'])
+        zone_id = await self._get_zone_id_for_domain(domain.name)
+        change_id = await self.changes.upsert(zone_id, {
+            'Name': hostname,
+            'Type': 'A',
+            'TTL': 300,
+            'ResourceRecords': [
+                {
+                    'Value': x
+                } for x in ip_addrs
+            ],
+        })
+        await self._wait_for_change_id(change_id)
 
-    async def get_txt_records(self, domain):
+    async def get_txt_records(self, domainname):
         # Find existing TXT records for the domain
-        zone_id = self._get_zone_id_for_domain(domain.name)
-        client = self.get_client()
-        response = client.list_resource_record_sets(
-            HostedZoneId=zone_id,
-            StartRecordType='TXT',
-            StartRecordName=domain,
-            MaxItems='1'
-        )
-        rrs = response['ResourceRecordSets']
-        values = []
-        if len(rrs) > 0:
-            if rrs[0]['Type'] == 'TXT' and rrs[0]['Name'] == f"{domain}.":
-                values = [x['Value'] for x in rrs[0]['ResourceRecords']]
-        return values
+        return await self.get_record_values(domainname, 'TXT')
 
     async def check_google_site_verification(self, domain):
         # See if we already have it (or another one)
@@ -225,6 +333,9 @@ class Route53(DNSProviderAgent):
     async def set_google_site_verification(self, domain):
         # Otherwise, it needs setting/updating...
         txt_to_be_set = f"\"google-site-verification={domain.google_site_verification}\""
+        # The existing values are kept, so read them afresh rather than from
+        # a snapshot that may predate changes made elsewhere
+        self.forget_cached_records(domain.name)
         values = await self.get_txt_records(domain.name)
         for value in values:
             if value == txt_to_be_set:
@@ -235,28 +346,15 @@ class Route53(DNSProviderAgent):
                 _logger.warning(f"Found unexpected Google Site Verification TXT record for {domain.name} with value: {existing_gsv}")
         values.append(txt_to_be_set)
         _logger.info(f"Adding TXT record to {domain.name} with GSV {domain.google_site_verification}...")
-        zone_id = self._get_zone_id_for_domain(domain.name)
-        client = self.get_client()
-        response = client.change_resource_record_sets(
-            HostedZoneId=zone_id,
-            ChangeBatch={
-                'Comment': 'SDMGR setting Google Site Verification',
-                'Changes': [
-                    {
-                        'Action': 'UPSERT',
-                        'ResourceRecordSet': {
-                            'Name': f"{domain.name}.",
-                            'Type': 'TXT',
-                            'TTL': 300,
-                            'ResourceRecords': [
-                                {
-                                    'Value': x
-                                } for x in values
-                            ],
-                        }
-                    },
-                ]
-            }
-        )
-
-        await self._wait_for_change_id(response['ChangeInfo']['Id'])
+        zone_id = await self._get_zone_id_for_domain(domain.name)
+        change_id = await self.changes.upsert(zone_id, {
+            'Name': f"{domain.name}.",
+            'Type': 'TXT',
+            'TTL': 300,
+            'ResourceRecords': [
+                {
+                    'Value': x
+                } for x in values
+            ],
+        })
+        await self._wait_for_change_id(change_id)
@@ -0,0 +1,112 @@
+import asyncio
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+# Route53 limits per ChangeBatch. UPSERTs count twice towards both.
+MAX_RECORDS = 1000
+MAX_VALUE_CHARS = 32000
+
+
+def _change_cost(change):
+    records = change['ResourceRecordSet'].get('ResourceRecords', [])
+    factor = 2 if change['Action'] == 'UPSERT' else 1
+    return (factor * max(1, len(records)), factor * sum(len(x['Value']) for x in records))
+
+
+class ZoneChangeBatcher:
+    """
+    Collects record set changes for each zone over a short window, and
+    sends them as one ChangeBatch per zone (split only where Route53's
+    limits require it). Later changes to the same record set replace
+    earlier ones still waiting to be sent. Each caller gets the id of the
+    change their record set was sent in, shared with the rest of its batch.
+    """
+
+    def __init__(self, agent, flush_secs):
+        self.agent = agent
+        self.flush_secs = flush_secs
+        self.pending = {}
+        self.batches_sent = 0
+        self.changes_sent = 0
+
+    async def submit(self, zone_id, action, record_set):
+        """
+        Queue a change to a record set in the zone, returning the change id
+        once it has been sent.
+        """
+        key = (record_set['Name'].rstrip('.').lower(), record_set['Type'])
+        future = asyncio.get_event_loop().create_future()
+        if zone_id not in self.pending:
+            self.pending[zone_id] = {}
+            asyncio.ensure_future(self._flush_later(zone_id))
+
+        # Replace any change to the same record set still waiting to be sent
+        zone = self.pending[zone_id]
+        if key in zone:
+            zone[key][1].append(future)
+            zone[key] = ({'Action': action, 'ResourceRecordSet': record_set}, zone[key][1])
+        else:
+            zone[key] = ({'Action': action, 'ResourceRecordSet': record_set}, [future])
+        return await future
+
+    async def upsert(self, zone_id, record_set):
+        return await self.submit(zone_id, 'UPSERT', record_set)
+
+    async def _flush_later(self, zone_id):
+        await asyncio.sleep(self.flush_secs)
+        zone = self.pending.pop(zone_id, {})
+        for batch in self._split(list(zone.values())):
+            await self._send(zone_id, batch)
+
+    def _split(self, entries):
+        batch = []
+        records = chars = 0
+        for entry in entries:
+            (cost_records, cost_chars) = _change_cost(entry[0])
+            if len(batch) > 0 and (records + cost_records > MAX_RECORDS or chars + cost_chars > MAX_VALUE_CHARS):
+                yield batch
+                batch = []
+                records = chars = 0
+            batch.append(entry)
+            records += cost_records
+            chars += cost_chars
+        if len(batch) > 0:
+            yield batch
+
+    async def _send(self, zone_id, batch):
+        changes = [change for change, futures in batch]
+        futures = [future for change, futures in batch for future in futures]
+        try:
+            _logger.info(f"Sending {len(changes)} record set change(s) for zone {zone_id} to {self.agent.label}...")
+            response = await self.agent._call('change_resource_record_sets',
+                HostedZoneId=zone_id,
+                ChangeBatch={
+                    'Comment': f"SDMGR updating {len(changes)} record set(s)",
+                    'Changes': changes,
+                }
+            )
+            change_id = response['ChangeInfo']['Id']
+            self.agent.records.apply(zone_id, changes)
+            self.batches_sent += 1
+            self.changes_sent += len(changes)
+        except Exception as e:
+            # We can't be sure what the zone now holds
+            self.agent.records.invalidate(zone_id)
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future in futures:
+            if not future.done():
+                future.set_result(change_id)
+
+    def metrics(self):
+        return {
+            "pending_zones": len(self.pending),
+            "pending_changes": sum(len(x) for x in self.pending.values()),
+            "batches_sent": self.batches_sent,
+            "changes_sent": self.changes_sent,
+        }
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class ChangePoller:
+    """
+    Polls the status of all the agent's pending changes from a single task,
+    backing off exponentially for changes that take a while to go INSYNC.
+    Everyone waiting on a change shares the same future.
+    """
+
+    def __init__(self, agent, initial_secs, max_secs):
+        self.agent = agent
+        self.initial_secs = initial_secs
+        self.max_secs = max_secs
+        self.pending = {}
+        self.task = None
+        self.completed = 0
+        self.total_latency = 0
+        self.last_latency = 0
+
+    def wait(self, change_id):
+        """
+        A future resolved once the change is INSYNC.
+        """
+        if change_id not in self.pending:
+            future = asyncio.get_event_loop().create_future()
+            now = time.monotonic()
+            self.pending[change_id] = {
+                "future": future,
+                "submitted": now,
+                "next_poll": now + self.initial_secs,
+                "delay": self.initial_secs,
+            }
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._poll_loop())
+        return asyncio.shield(self.pending[change_id]["future"])
+
+    async def _poll_loop(self):
+        while len(self.pending) > 0:
+            now = time.monotonic()
+            wake = min(x["next_poll"] for x in self.pending.values())
+            if wake > now:
+                await asyncio.sleep(wake - now)
+                continue
+            due = [change_id for change_id, x in self.pending.items() if x["next_poll"] <= now]
+            await asyncio.gather(*[self._poll(change_id) for change_id in due])
+
+    async def _poll(self, change_id):
+        entry = self.pending[change_id]
+        _logger.debug(f"Polling change id '{change_id}'")
+        try:
+            response = await self.agent._call('get_change', Id=change_id)
+            status = response["ChangeInfo"]["Status"]
+        except asyncio.CancelledError:
+            raise
+        except KeyError:
+            _logger.error(f"Unexpected response for change {change_id}: {response}")
+            status = "INSYNC"
+        except Exception as e:
+            _logger.exception(e)
+            status = None
+
+        if status == "INSYNC":
+            latency = time.monotonic() - entry["submitted"]
+            self.completed += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            del self.pending[change_id]
+            _logger.debug(f"Change {change_id} INSYNC after {latency:.1f} secs")
+            if not entry["future"].done():
+                entry["future"].set_result(status)
+            return
+
+        entry["delay"] = min(self.max_secs, entry["delay"] * 2)
+        entry["next_poll"] = time.monotonic() + entry["delay"]
+
+    def metrics(self):
+        return {
+            "polled_changes": len(self.pending),
+            "completed_changes": self.completed,
+            "mean_insync_seconds": self.total_latency / self.completed if self.completed > 0 else 0,
+            "last_insync_seconds": self.last_latency,
+        }
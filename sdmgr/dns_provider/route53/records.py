@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+def record_key(name, type):
+    return (name.rstrip('.').lower(), type)
+
+
+def record_values(record_set):
+    return sorted(x['Value'] for x in record_set.get('ResourceRecords', []))
+
+
+class ZoneRecordCache:
+    """
+    Snapshots of the record sets in each zone, fetched in full (following
+    every page) when first needed, and again once older than 'max_age'
+    seconds or marked stale. Changes we send are applied to the snapshot
+    as they go, so our own updates don't need a refetch.
+    """
+
+    def __init__(self, agent, max_age):
+        self.agent = agent
+        self.max_age = max_age
+        self.zones = {}
+        self.fetching = {}
+        self.fetches = 0
+        self.hits = 0
+
+    async def get(self, zone_id):
+        """
+        The zone's record sets, keyed by (name, type).
+        """
+        zone = self.zones.get(zone_id)
+        if zone is not None and not zone["stale"] and time.monotonic() - zone["fetched"] < self.max_age:
+            self.hits += 1
+            return zone["records"]
+
+        # Share a fetch already in progress for the zone
+        if zone_id not in self.fetching:
+            self.fetching[zone_id] = asyncio.ensure_future(self._fetch(zone_id))
+        try:
+            return await asyncio.shield(self.fetching[zone_id])
+        finally:
+            if self.fetching.get(zone_id) is not None and self.fetching[zone_id].done():
+                del self.fetching[zone_id]
+
+    async def _fetch(self, zone_id):
+        records = {}
+        kwargs = {
+            "HostedZoneId": zone_id,
+            "MaxItems": str(300),
+        }
+        while True:
+            response = await self.agent._call('list_resource_record_sets', **kwargs)
+            for record_set in response['ResourceRecordSets']:
+                records[record_key(record_set['Name'], record_set['Type'])] = record_set
+            if not response['IsTruncated']:
+                break
+            kwargs['StartRecordName'] = response['NextRecordName']
+            kwargs['StartRecordType'] = response['NextRecordType']
+            if 'NextRecordIdentifier' in response:
+                kwargs['StartRecordIdentifier'] = response['NextRecordIdentifier']
+            else:
+                kwargs.pop('StartRecordIdentifier', None)
+
+        self.fetches += 1
+        self.zones[zone_id] = {
+            "fetched": time.monotonic(),
+            "stale": False,
+            "records": records,
+        }
+        _logger.debug(f"Fetched {len(records)} record sets for zone {zone_id} from {self.agent.label}.")
+        return records
+
+    def invalidate(self, zone_id):
+        if zone_id in self.zones:
+            self.zones[zone_id]["stale"] = True
+
+    def forget(self, zone_id):
+        self.zones.pop(zone_id, None)
+
+    def apply(self, zone_id, changes):
+        """
+        Update the snapshot of a zone (if we have one) with changes that
+        Route53 has accepted.
+        """
+        zone = self.zones.get(zone_id)
+        if zone is None:
+            return
+        for change in changes:
+            record_set = change['ResourceRecordSet']
+            key = record_key(record_set['Name'], record_set['Type'])
+            if change['Action'] == 'DELETE':
+                zone["records"].pop(key, None)
+            else:
+                zone["records"][key] = record_set
+
+    async def diff(self, zone_id, desired):
+        """
+        Compare the desired record sets for a zone with its snapshot.
+        Returns the UPSERT changes needed to bring the zone in line, and the
+        keys of any record sets in the zone that aren't desired (other than
+        the apex NS/SOA records).
+        """
+        records = await self.get(zone_id)
+        wanted = {record_key(x['Name'], x['Type']): x for x in desired}
+
+        changes = []
+        for key, record_set in wanted.items():
+            current = records.get(key)
+            if current is None or record_values(current) != record_values(record_set) or current.get('TTL') != record_set.get('TTL'):
+                changes.append({'Action': 'UPSERT', 'ResourceRecordSet': record_set})
+
+        extra = [key for key in records if key not in wanted and key[1] not in ('NS', 'SOA')]
+        return changes, extra
+
+    def metrics(self):
+        return {
+            "cached_zones": len(self.zones),
+            "zone_fetches": self.fetches,
+            "zone_cache_hits": self.hits,
+        }
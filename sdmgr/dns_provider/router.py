@@ -3,7 +3,12 @@ from starlette.responses import JSONResponse, Response
 
 from sdmgr.oauth2 import *
 from sdmgr.db import *
+from sdmgr import settings
 from sdmgr.manager import m
+from sdmgr.jobs.router import refresh_in_worker, runs_in_worker, job_accepted
+
+from pydantic import BaseModel
+from typing import List
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -11,6 +16,10 @@ _logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+class ZonesCreateForm(BaseModel):
+    domains: List[str]
+
+
 @router.get("/dns_providers", tags=["dns"])
 async def list_dns_providers(user = Depends(get_current_user)):
     dns_providers = await DNSProvider.objects.all()
@@ -28,6 +37,8 @@ async def refresh_dns_provider(id: int, user = Depends(get_current_user)):
     """
     Trigger a refresh of the domain data hosted by this agent. Used to force a fresh copy of the domains list to be fetched from the API.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return await refresh_in_worker("dns", id)
     agent = m.dns_agents[id]
     status = await agent.refresh()
     return JSONResponse({
@@ -39,8 +50,20 @@ async def get_dns_provider_status_for_domain(id: int, domainname, user = Depends
     """
     Fetch the status of a domain from the nameservice provider. Used to show the current status of the domain's name servers, including their main NS records.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return runs_in_worker()
     agent = m.dns_agents[id]
     status = await agent.get_status_for_domain(domainname)
     return JSONResponse({
         "status": status
     })
+
+@router.post("/dns_providers/{id:int}/zones", tags=["dns"])
+async def create_dns_provider_zones(id: int, zones_in: ZonesCreateForm, user = Depends(get_current_user)):
+    """
+    Create zones for a list of domains with the DNS provider, i.e. when onboarding a batch of domains. Runs as a background job, returning a 202 with the job's location.
+    """
+    _logger.info(f"User '{user.username}' creating {len(zones_in.domains)} zones with DNS provider {id}.")
+    job = await m.jobs.submit("create_dns_zones", {"agent_id": id, "domainnames": zones_in.domains},
+        f"Creating {len(zones_in.domains)} zones with DNS provider {id}")
+    return await job_accepted(job)
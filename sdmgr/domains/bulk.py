@@ -0,0 +1,64 @@
+from sdmgr.db import database, Domain
+
+import sqlalchemy
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+# orm only applies field defaults when creating through the model, so bulk
+# inserts have to supply them
+DOMAIN_DEFAULTS = {
+    "dns": None,
+    "site": None,
+    "waf": None,
+    "update_apex": True,
+    "update_a_records": "www",
+    "google_site_verification": None,
+    "state": "{}",
+    "active": True,
+    "next_check_at": None,
+    "check_interval": None,
+}
+
+
+async def fetch_domain_map(domainnames, *columns, chunk_size = 500):
+    """
+    Map of name to (id, *columns) for those of the given domains that
+    exist, in batches.
+    """
+    table = Domain.__table__
+    domainnames = list(domainnames)
+    domains = {}
+    for i in range(0, len(domainnames), chunk_size):
+        query = sqlalchemy.select([table.c.name, table.c.id] + [table.c[x] for x in columns]).where(
+            table.c.name.in_(domainnames[i:i + chunk_size])
+        )
+        for row in await database.fetch_all(query):
+            domains[row[0]] = tuple(row[i] for i in range(1, len(columns) + 2))
+    return domains
+
+
+async def insert_domains(domainnames, chunk_size = 500, **values):
+    """
+    Insert domains with the given names (and column values) in batches.
+    Call within a transaction.
+    """
+    table = Domain.__table__
+    domainnames = list(domainnames)
+    for i in range(0, len(domainnames), chunk_size):
+        rows = [{**DOMAIN_DEFAULTS, **values, "name": name} for name in domainnames[i:i + chunk_size]]
+        await database.execute(table.insert().values(rows))
+
+
+async def update_domains(domain_ids, chunk_size = 500, **values):
+    """
+    Set the given column values on the domains with the given ids, in
+    batches. Call within a transaction.
+    """
+    table = Domain.__table__
+    domain_ids = list(domain_ids)
+    for i in range(0, len(domain_ids), chunk_size):
+        await database.execute(table.update().where(
+            table.c.id.in_(domain_ids[i:i + chunk_size])
+        ).values(**values))
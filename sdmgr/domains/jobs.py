@@ -0,0 +1,66 @@
+from sdmgr.db import Domain, StatusCheck
+from sdmgr.jobs import register_job_handler, run_step
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+async def _domain_checks(domain):
+    # A '__startswith' filter would be better...
+    # (https://github.com/encode/orm/issues/49)
+    checks = StatusCheck.objects.filter(_check_id__contains=f"domain:{domain.name}:")
+    return [await check.serialize() for check in await checks.all()]
+
+async def _check_status(domain, status):
+    return {
+        "status": await status.serialize() if status is not None else None,
+        "checks": await _domain_checks(domain)
+    }
+
+
+@register_job_handler("check_domain")
+async def check_domain(manager, domain_id):
+    domain = await Domain.objects.get(id = domain_id)
+    await manager.check_domain(domain)
+    return {
+        "checks": await _domain_checks(domain)
+    }
+
+@register_job_handler("apply_domain")
+async def apply_domain(manager, domain_id):
+    domain = await Domain.objects.get(id = domain_id)
+    await run_step("apply", manager.apply_domain, domain)
+    await manager.check_domain(domain)
+    return {
+        "checks": await _domain_checks(domain)
+    }
+
+@register_job_handler("check_domain_ns")
+async def check_domain_ns(manager, domain_id):
+    domain = await Domain.objects.get(id = domain_id)
+    status = await manager.check_domain_ns_records(domain)
+    return await _check_status(domain, status)
+
+@register_job_handler("check_domain_a")
+async def check_domain_a(manager, domain_id):
+    domain = await Domain.objects.get(id = domain_id)
+    status = await manager.check_domain_a_records(domain)
+    return await _check_status(domain, status)
+
+@register_job_handler("check_domain_gsv")
+async def check_domain_gsv(manager, domain_id):
+    domain = await Domain.objects.get(id = domain_id)
+    status = await manager.check_domain_google_site_verification(domain)
+    return await _check_status(domain, status)
+
+@register_job_handler("check_domain_waf")
+async def check_domain_waf(manager, domain_id):
+    domain = await Domain.objects.get(id = domain_id)
+    status = await manager.check_domain_waf(domain)
+    return {
+        "domain": {
+            "id": domain.id,
+            "name": domain.name
+        },
+        "status": status
+    }
@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, File
 from starlette.responses import JSONResponse, Response
+from starlette.status import HTTP_202_ACCEPTED
 
 from sdmgr.oauth2 import *
 from sdmgr.db import *
 from sdmgr.manager import m
+from sdmgr.jobs.router import job_accepted
+
+# Registers the domain job handlers, so API-only processes can submit them
+import sdmgr.domains.jobs  # noqa: F401
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -93,6 +98,7 @@ async def update_domain(id: int, domain_in: DomainUpdateForm, user = Depends(get
             await domain.update(**update_kwargs)
             for notice in notices:
                 _logger.info(notice)
+            await m.reset_domain_check_interval(domain)
         except Exception as e:
             _logger.exception(e)
 
@@ -116,93 +122,72 @@ async def get_domain_checks(id: int, user = Depends(get_current_user)):
         "checks": [await check.serialize() for check in await checks.all()]
     })
 
-@router.get("/domains/{id:int}/check", tags=["domains"])
+@router.get("/domains/{id:int}/check", tags=["domains"], status_code=HTTP_202_ACCEPTED)
 async def check_domain(id: int, user = Depends(get_current_user)):
     """
-    Restart checks for domain.
+    Restart checks for domain. The checks are run in the background, and the
+    job returned can be polled for the results.
     """
     domain = await Domain.objects.get(id=id)
     _logger.info(f"User '{user.username}' restarting domain checks for '{domain.name}'.")
-    # TODO make request asynchronous...
-    await m.check_domain(domain)
-    checks = StatusCheck.objects.filter(_check_id__contains=f"domain:{domain.name}:")
-    return JSONResponse({
-        "checks": [await check.serialize() for check in await checks.all()]
-    })
+    job = await m.jobs.submit("check_domain", {"domain_id": domain.id}, f"Checking domain '{domain.name}'",
+        idempotency_key = f"check_domain:{domain.id}")
+    return await job_accepted(job)
 
-@router.get("/domains/{id:int}/apply", tags=["domains"])
+@router.get("/domains/{id:int}/apply", tags=["domains"], status_code=HTTP_202_ACCEPTED)
 async def apply_domain(id: int, user = Depends(get_current_user)):
     """
-    Apply necessary changes for domain.
+    Apply necessary changes for domain, then re-run the checks. The changes
+    are applied in the background, and the job returned can be polled for
+    the results.
     """
     domain = await Domain.objects.get(id=id)
     _logger.info(f"User '{user.username}' applying domain configuration for '{domain.name}'.")
-    await m.apply_domain(domain)
-    # TODO make request asynchronous...
-    status = await m.check_domain(domain)
-    checks = StatusCheck.objects.filter(_check_id__contains=f"domain:{domain.name}:")
-    return JSONResponse({
-        "status": status.serialize(),
-        "checks": [await check.serialize() for check in await checks.all()]
-    })
+    job = await m.jobs.submit("apply_domain", {"domain_id": domain.id}, f"Applying configuration for domain '{domain.name}'",
+        idempotency_key = f"apply_domain:{domain.id}")
+    return await job_accepted(job)
 
-@router.get("/domains/{id:int}/check/ns", tags=["domains"])
+@router.get("/domains/{id:int}/check/ns", tags=["domains"], status_code=HTTP_202_ACCEPTED)
 async def check_domain_ns(id: int, user = Depends(get_current_user)):
     """
-    Check the DNS NS records for this domain.
+    Check the DNS NS records for this domain, in the background.
     """
     domain = await Domain.objects.get(id = id)
     _logger.info(f"User '{user.username}' checking NS records for '{domain.name}'.")
-    # TODO make request asynchronous...
-    status = await m.check_domain_ns_records(domain)
-    checks = StatusCheck.objects.filter(_check_id__contains=f"domain:{domain.name}:")
-    return JSONResponse({
-        "status": await status.serialize(),
-        "checks": [await check.serialize() for check in await checks.all()]
-    })
+    job = await m.jobs.submit("check_domain_ns", {"domain_id": domain.id}, f"Checking NS records for '{domain.name}'",
+        idempotency_key = f"check_domain_ns:{domain.id}")
+    return await job_accepted(job)
 
-@router.get("/domains/{id:int}/check/a", tags=["domains"])
+@router.get("/domains/{id:int}/check/a", tags=["domains"], status_code=HTTP_202_ACCEPTED)
 async def check_domain_a(id: int, user = Depends(get_current_user)):
     """
-    Check the DNS A records for this domain.
+    Check the DNS A records for this domain, in the background.
     """
     domain = await Domain.objects.get(id = id)
     _logger.info(f"User '{user.username}' checking A records for '{domain.name}'.")
-    # TODO make request asynchronous...
-    status = await m.check_domain_a_records(domain)
-    checks = StatusCheck.objects.filter(_check_id__contains=f"domain:{domain.name}:")
-    return JSONResponse({
-        "status": await status.serialize(),
-        "checks": [await check.serialize() for check in await checks.all()]
-    })
+    job = await m.jobs.submit("check_domain_a", {"domain_id": domain.id}, f"Checking A records for '{domain.name}'",
+        idempotency_key = f"check_domain_a:{domain.id}")
+    return await job_accepted(job)
 
-@router.get("/domains/{id:int}/check/gsv", tags=["domains"], summary="Check Domain Google Site Verification record")
+@router.get("/domains/{id:int}/check/gsv", tags=["domains"], status_code=HTTP_202_ACCEPTED, summary="Check Domain Google Site Verification record")
 async def check_domain_gsv(id: int, user = Depends(get_current_user)):
     """
-    Check that the DNS TXT records for this domain contains the correct Google Site Verification token.
+    Check that the DNS TXT records for this domain contains the correct Google Site Verification token, in the background.
     - **id**: domain id
     """
     domain = await Domain.objects.get(id = id)
     _logger.info(f"User '{user.username}' checking Google Site Verification TXT records for '{domain.name}'.")
-    # TODO make request asynchronous...
-    status = await m.check_domain_google_site_verification(domain)
-    checks = StatusCheck.objects.filter(_check_id__contains=f"domain:{domain.name}:")
-    return JSONResponse({
-        "status": await status.serialize(),
-        "checks": [await check.serialize() for check in await checks.all()]
-    })
+    job = await m.jobs.submit("check_domain_gsv", {"domain_id": domain.id}, f"Checking Google Site Verification for '{domain.name}'",
+        idempotency_key = f"check_domain_gsv:{domain.id}")
+    return await job_accepted(job)
 
-@router.get("/domains/{id:int}/check/waf", tags=["domains"])
+@router.get("/domains/{id:int}/check/waf", tags=["domains"], status_code=HTTP_202_ACCEPTED)
 async def check_domain_waf(id: int, user = Depends(get_current_user)):
     """
-    Check the WAF setup for this domain.
+    Check the WAF setup for this domain, in the background.
     """
     domain = await Domain.objects.get(id = id)
-    status = await m.check_domain_waf(domain)
-    return JSONResponse({
-        "domain": {
-            "id": id,
-            "name": domain.name
-        },
-        "status": status
-    })
+    _logger.info(f"User '{user.username}' checking WAF for '{domain.name}'.")
+    job = await m.jobs.submit("check_domain_waf", {"domain_id": domain.id}, f"Checking WAF for '{domain.name}'",
+        idempotency_key = f"check_domain_waf:{domain.id}")
+    return await job_accepted(job)
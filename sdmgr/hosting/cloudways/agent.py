@@ -1,5 +1,6 @@
 from ..base import HostingAgent
 from ...db import Site, Hosting
+from sdmgr.ratelimit import check_rate_limit
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -27,6 +28,10 @@ class Cloudways(HostingAgent):
         },
     ]
 
+    # Cloudways allows 30 API calls a minute
+    _rate_limit_ = 0.5
+    _rate_burst_ = 5
+
     def __init__(self, data, manager):
         _logger.info(f"Loading Cloudways hosting provider agent (id: {data.id}): {data.label})")
         HostingAgent.__init__(self, data, manager)
@@ -50,6 +55,22 @@ class Cloudways(HostingAgent):
         }
         await super(Cloudways, self)._save_state()
 
+    async def _request(self, method, url, **kwargs):
+        """
+        Make a request to the Cloudways API within the agent's budget,
+        retrying it if rate limited. Returns the response status and body
+        (decoded, if JSON).
+        """
+        return await self.budget.call(self._request_once, method, url, **kwargs)
+
+    async def _request_once(self, method, url, **kwargs):
+        async with aiohttp.ClientSession() as session:
+            async with session.request(method, url, **kwargs) as response:
+                check_rate_limit(response, "Cloudways")
+                if response.content_type == "application/json":
+                    return (response.status, await response.json())
+                return (response.status, await response.text())
+
     def _has_token_expired(self):
         return self.token_expires is None or self.token_expires < datetime.datetime.now()
 
@@ -62,12 +83,10 @@ class Cloudways(HostingAgent):
             "email": self._config("api_email"),
             "api_key": self._config("api_key")
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=payload) as response:
-                if response.status != 200:
-                    _logger.error(f"Unexpected response from Cloudways API: {response.status}")
-                    return
-                data = await response.json()
+        status, data = await self._request("POST", url, data=payload)
+        if status != 200:
+            _logger.error(f"Unexpected response from Cloudways API: {status}")
+            return
 
         access_token = data['access_token']
         self.headers = {
@@ -115,20 +134,17 @@ class Cloudways(HostingAgent):
             'app_id': app_id,
             'aliases[]': aliases
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=self.headers, data=payload) as response:
-                if response.status == 200:
-                    _logger.debug("Set aliases successfully.")
-                    return
-                elif response.status == 422:
-                    data = await response.json()
-                    _logger.warning(data['aliases']['message'])
-                    return
-                else:
-                    print(await response.text())
-                    _logger.error(f"Unexpected response from Cloudways API: {response.status}")
-                    return
-                #data = await response.json()
+        status, data = await self._request("POST", url, headers=self.headers, data=payload)
+        if status == 200:
+            _logger.debug("Set aliases successfully.")
+            return
+        elif status == 422:
+            _logger.warning(data['aliases']['message'])
+            return
+        else:
+            print(data)
+            _logger.error(f"Unexpected response from Cloudways API: {status}")
+            return
 
         await self.refresh()
 
@@ -155,18 +171,16 @@ class Cloudways(HostingAgent):
             'wild_card': False,
             'ssl_domains': aliases
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=self.headers, data=payload) as response:
-                if response.status == 200:
-                    _logger.info("Set SSL certificates successfully.")
-                    return
-                elif response.status == 422:
-                    data = await response.json()
-                    _logger.warning(data['aliases']['message'])
-                    return
-                else:
-                    _logger.error(f"Unexpected response from Cloudways API: {response.status}")
-                    return
+        status, data = await self._request("POST", url, headers=self.headers, data=payload)
+        if status == 200:
+            _logger.info("Set SSL certificates successfully.")
+            return
+        elif status == 422:
+            _logger.warning(data['aliases']['message'])
+            return
+        else:
+            _logger.error(f"Unexpected response from Cloudways API: {status}")
+            return
 
     async def refresh(self):
         await self._auth()
@@ -174,12 +188,10 @@ class Cloudways(HostingAgent):
         # Fetch list of servers
         _logger.info(f"Fetching server list from {self.label}...")
         url = BASE_URL + "server"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as response:
-                if response.status != 200:
-                    _logger.error(f"Unexpected response from Cloudways API: {response.status}")
-                    return
-                data = await response.json()
+        status, data = await self._request("GET", url, headers=self.headers)
+        if status != 200:
+            _logger.error(f"Unexpected response from Cloudways API: {status}")
+            return
 
         self.servers = data['servers']
         _logger.info(f"Found {len(self.servers)} servers on {self.label}")
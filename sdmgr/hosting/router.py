@@ -3,7 +3,9 @@ from starlette.responses import JSONResponse, Response
 
 from sdmgr.oauth2 import *
 from sdmgr.db import *
+from sdmgr import settings
 from sdmgr.manager import m
+from sdmgr.jobs.router import refresh_in_worker
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -25,6 +27,8 @@ async def refresh_hosting_provider(id: int, user = Depends(get_current_user)):
     Fetch a fresh copy of the information about the sites hosted by this agent.
     Used to force a fresh copy of the sites to be fetched from the API.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return await refresh_in_worker("hosting", id)
     agent = m.hosting_agents[id]
     status = await agent.refresh()
     return JSONResponse({
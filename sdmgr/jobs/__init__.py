@@ -0,0 +1,300 @@
+from sdmgr.db import database, Job
+from sdmgr.jobs.uploads import delete_uploads_before
+import sdmgr.settings as settings
+
+import asyncio
+import contextvars
+import datetime
+import importlib
+import os
+import socket
+import uuid
+import sqlalchemy
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+UNFINISHED_STATES = ["pending", "running"]
+
+# Job handlers, by kind of job
+job_handlers = {}
+
+def register_job_handler(kind):
+    def decorator(handler):
+        job_handlers[kind] = handler
+        return handler
+    return decorator
+
+
+class UnknownJobKindException(Exception):
+    pass
+
+
+# Ensure all job handler modules are imported/registered...
+def load_job_handlers():
+    for module_name in settings.jobs_to_import:
+        importlib.import_module(module_name)
+
+
+# The job (if any) the current task is running on behalf of
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+async def save_checkpoint(**values):
+    """
+    Record progress of the current job, so that it can pick up where it left
+    off if the process is restarted. Does nothing outside of a job.
+    """
+    job = _current_job.get()
+    if job is None:
+        return
+    checkpoint = dict(job.checkpoint or {})
+    checkpoint.update(values)
+    # Set it before writing it, so concurrent steps don't lose each other's
+    job.checkpoint = checkpoint
+    await job.update(checkpoint = checkpoint)
+
+async def run_step(name, func, *args):
+    """
+    Run one step of the current job, unless a previous attempt at the job
+    already completed it.
+    """
+    job = _current_job.get()
+    if job is None:
+        return await func(*args)
+    if name in (job.checkpoint or {}).get("steps", []):
+        _logger.info(f"Job {job.job_id} already completed step '{name}'. Skipping.")
+        return
+    result = await func(*args)
+    steps = (job.checkpoint or {}).get("steps", [])
+    await save_checkpoint(steps = steps + [name])
+    return result
+
+
+class JobRunner:
+    """
+    Runs submitted jobs in the background, a limited number at a time. Jobs
+    are recorded in the 'jobs' table as they change state, so unfinished
+    jobs can be resumed by the next process to start, and jobs submitted by
+    an API-only process can be picked up by a separate worker process.
+    """
+
+    def __init__(self, manager, concurrency, max_attempts, retention_secs):
+        self.manager = manager
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retention_secs = retention_secs
+        self.purged_time = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.executing = False
+        self.semaphore = None
+        self.tasks = {}
+
+    async def start(self, poll_frequency, live_owners = ()):
+        """
+        Start executing jobs in this process: resume any left unfinished,
+        then keep picking up newly submitted ones.
+        """
+        self.executing = True
+        await self.resume(live_owners)
+        asyncio.create_task(self._poll_loop(poll_frequency))
+
+    async def submit(self, kind, params, description, idempotency_key = None):
+        """
+        Record a new job, and start it if this process executes jobs (it
+        will otherwise be picked up by a worker). If an unfinished job
+        already exists with the same idempotency key, that job is returned
+        instead.
+        """
+        if kind not in job_handlers:
+            raise UnknownJobKindException(kind)
+
+        if idempotency_key is not None:
+            existing = await Job.objects.filter(idempotency_key = idempotency_key, state__in = UNFINISHED_STATES).all()
+            if len(existing) > 0:
+                _logger.info(f"Job {existing[0].job_id} already submitted for '{idempotency_key}'.")
+                return existing[0]
+
+        job = await Job.objects.create(
+            job_id = uuid.uuid4().hex,
+            kind = kind,
+            params = params,
+            description = description,
+            idempotency_key = idempotency_key,
+            state = "pending",
+            checkpoint = {},
+            attempts = 0,
+            createdTime = datetime.datetime.now(),
+        )
+        _logger.info(f"Submitted job {job.job_id}: {description}")
+        if self.executing:
+            await self._claim(job)
+        return job
+
+    async def _claim(self, job):
+        """
+        Take ownership of a pending job and start it. Several processes may
+        try to claim the same job, but only one update will match.
+        """
+        table = Job.__table__
+        query = table.update().where(sqlalchemy.and_(
+            table.c._id == job._id,
+            table.c.state == "pending"
+        )).values(state = "running", owner = self.owner)
+        await database.execute(query)
+        job = await Job.objects.get(_id = job._id)
+        if job.owner != self.owner:
+            return False
+        self._start(job)
+        return True
+
+    async def _poll_loop(self, frequency):
+        while True:
+            try:
+                await self.purge()
+                capacity = self.concurrency - len(self.tasks)
+                if capacity > 0:
+                    table = Job.__table__
+                    query = table.select().where(table.c.state == "pending").order_by(table.c._id).limit(capacity)
+                    for row in await database.fetch_all(query):
+                        await self._claim(Job(**dict(row)))
+            except Exception as e:
+                _logger.exception(e)
+            await asyncio.sleep(frequency)
+
+    async def purge(self):
+        """
+        Delete jobs that finished more than 'retention_secs' ago (and any
+        uploads left unread as long), at most once a minute.
+        """
+        now = datetime.datetime.now()
+        if self.purged_time is not None and (now - self.purged_time).total_seconds() < 60:
+            return
+        self.purged_time = now
+        cutoff = now - datetime.timedelta(seconds = self.retention_secs)
+        table = Job.__table__
+        await database.execute(table.delete().where(sqlalchemy.and_(
+            table.c.state.in_(["succeeded", "failed"]),
+            table.c.endTime < cutoff
+        )))
+        await delete_uploads_before(cutoff)
+
+    def _start(self, job):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.tasks[job.job_id] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        async with self.semaphore:
+            token = _current_job.set(job)
+            try:
+                await job.update(
+                    state = "running",
+                    owner = self.owner,
+                    startedTime = datetime.datetime.now(),
+                    attempts = job.attempts + 1
+                )
+                await self._wait_for_pending_change(job)
+                handler = job_handlers[job.kind]
+                result = await handler(self.manager, **job.params)
+                await job.update(
+                    state = "succeeded",
+                    result = result,
+                    endTime = datetime.datetime.now()
+                )
+            except asyncio.CancelledError:
+                # Leave the job 'running', to be resumed on next start
+                _logger.info(f"Job {job.job_id} interrupted: {job.description}")
+                raise
+            except Exception as e:
+                _logger.exception(e)
+                await job.update(
+                    state = "failed",
+                    error = str(e),
+                    endTime = datetime.datetime.now()
+                )
+            finally:
+                _current_job.reset(token)
+                self.tasks.pop(job.job_id, None)
+                _logger.info(f"Job {job.job_id} {job.state}: {job.description}")
+
+    async def _wait_for_pending_change(self, job):
+        # If the job was interrupted while waiting for DNS changes to
+        # propagate, finish waiting for them rather than making them again.
+        # Each change waited on is recorded under its own key, as a job may
+        # wait on several at once.
+        pending = {
+            key: value for key, value in (job.checkpoint or {}).items()
+            if key.startswith("pending_change") and value is not None
+        }
+
+        async def wait(key, change):
+            _logger.info(f"Job {job.job_id} resuming wait for change '{change['change_id']}'...")
+            dns_agent = self.manager.dns_agents[change['dns_agent']]
+            await dns_agent.wait_for_change(change['change_id'])
+            await save_checkpoint(**{key: None})
+
+        await asyncio.gather(*[wait(key, change) for key, change in pending.items()])
+
+    async def _take_over(self, job):
+        """
+        Take ownership of a job left running by another process. Several
+        processes may try to take over the same job, but only one update
+        will match.
+        """
+        table = Job.__table__
+        query = table.update().where(sqlalchemy.and_(
+            table.c._id == job._id,
+            table.c.state == "running",
+            table.c.owner == job.owner
+        )).values(owner = self.owner)
+        await database.execute(query)
+        job = await Job.objects.get(_id = job._id)
+        if job.state != "running" or job.owner != self.owner:
+            return None
+        return job
+
+    async def resume(self, live_owners = ()):
+        """
+        Restart jobs left running by a process that has gone away, i.e. is
+        not one of the 'live_owners' (the replicas with a live heartbeat).
+        Jobs that have already been attempted too many times are marked as
+        failed. Pending jobs are left to be claimed by the poll loop.
+        """
+        jobs = await Job.objects.filter(state = "running").all()
+        for job in jobs:
+            if job.job_id in self.tasks:
+                continue
+            if job.owner in live_owners and job.owner != self.owner:
+                continue
+            job = await self._take_over(job)
+            if job is None:
+                continue
+            if job.attempts >= self.max_attempts:
+                _logger.warning(f"Job {job.job_id} abandoned after {job.attempts} attempts: {job.description}")
+                await job.update(
+                    state = "failed",
+                    error = f"Abandoned after {job.attempts} attempts.",
+                    endTime = datetime.datetime.now()
+                )
+                continue
+            _logger.info(f"Resuming job {job.job_id}: {job.description}")
+            self._start(job)
+
+    async def get(self, job_id):
+        return await Job.objects.get(job_id = job_id)
+
+    async def list(self, state = None, kind = None, limit = 100):
+        table = Job.__table__
+        query = table.select().order_by(table.c._id.desc()).limit(limit)
+        if state is not None:
+            query = query.where(table.c.state == state)
+        if kind is not None:
+            query = query.where(table.c.kind == kind)
+        return [Job(**dict(row)) for row in await database.fetch_all(query)]
+
+    async def metrics(self):
+        table = Job.__table__
+        query = sqlalchemy.select([table.c.state, sqlalchemy.func.count()]).group_by(table.c.state)
+        counts = {row[0]: row[1] for row in await database.fetch_all(query)}
+        return {state: counts.get(state, 0) for state in ("pending", "running", "succeeded", "failed")}
@@ -0,0 +1,50 @@
+from sdmgr.db import Site
+from sdmgr.jobs import register_job_handler
+from sdmgr.jobs.uploads import iter_upload, delete_upload
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+@register_job_handler("refresh_agent")
+async def refresh_agent(manager, agent_type, agent_id):
+    agent = manager.get_agent(agent_type, agent_id)
+    return {
+        "status": await agent.refresh()
+    }
+
+@register_job_handler("create_dns_zones")
+async def create_dns_zones(manager, agent_id, domainnames):
+    agent = manager.get_agent("dns", agent_id)
+    await agent.create_domains(domainnames)
+    return {
+        "created": domainnames
+    }
+
+@register_job_handler("import_registrar_file")
+async def import_registrar_file(manager, agent_id, format, upload_id):
+    agent = manager.get_agent("registrar", agent_id)
+    try:
+        if format == "csv":
+            res = await agent.update_from_csvfile(iter_upload(upload_id))
+        else:
+            res = await agent.update_from_jsonfile(iter_upload(upload_id))
+    except Exception:
+        # Retrying won't help a bad file, so it isn't kept
+        await delete_upload(upload_id)
+        raise
+    await delete_upload(upload_id)
+    return {
+        "records_read": res['count']
+    }
+
+@register_job_handler("check_site_ssl")
+async def check_site_ssl(manager, site_id):
+    site = await Site.objects.get(id = site_id)
+    return {
+        "site": {
+            "id": site.id,
+            "label": site.label
+        },
+        "status": await manager.check_site_ssl_certs(site)
+    }
@@ -0,0 +1,67 @@
+from fastapi import APIRouter, Depends, HTTPException
+from starlette.responses import JSONResponse
+from starlette.status import HTTP_202_ACCEPTED, HTTP_404_NOT_FOUND, HTTP_503_SERVICE_UNAVAILABLE
+
+from sdmgr.oauth2 import *
+from sdmgr.manager import m
+
+import orm
+
+import logging
+_logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+async def job_accepted(job):
+    """
+    Response for an endpoint that has submitted a job to do its work.
+    """
+    return JSONResponse({
+        "job": await job.serialize()
+    }, status_code=HTTP_202_ACCEPTED, headers={
+        "Location": f"{openapi_prefix}/jobs/{job.job_id}"
+    })
+
+async def refresh_in_worker(agent_type, id):
+    """
+    Response for a refresh endpoint when the agents run in a separate worker
+    process, which submits a job for the worker to do the refresh.
+    """
+    job = await m.jobs.submit("refresh_agent", {"agent_type": agent_type, "agent_id": id},
+        f"Refreshing {agent_type} agent {id}", idempotency_key = f"refresh_agent:{agent_type}:{id}")
+    return await job_accepted(job)
+
+def runs_in_worker():
+    """
+    Response for an endpoint that needs the agents when they run in a
+    separate worker process, and can't be done via a job.
+    """
+    return JSONResponse({
+        "detail": "Agents run in the worker process, which this endpoint can't reach."
+    }, status_code=HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@router.get("/jobs", tags=["jobs"])
+async def list_jobs(state: str = None, kind: str = None, limit: int = 100, user = Depends(get_current_user)):
+    """
+    List recent background jobs, newest first, optionally filtered by state
+    ('pending', 'running', 'succeeded' or 'failed') and/or kind.
+    """
+    jobs = await m.jobs.list(state = state, kind = kind, limit = limit)
+    return JSONResponse({
+        "jobs": [await job.serialize() for job in jobs]
+    })
+
+@router.get("/jobs/{job_id}", tags=["jobs"])
+async def get_job(job_id: str, user = Depends(get_current_user)):
+    """
+    Fetch the state of a background job, and its result once finished.
+    """
+    try:
+        job = await m.jobs.get(job_id)
+    except orm.exceptions.NoMatch:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"No such job '{job_id}'.")
+    return JSONResponse({
+        "job": await job.serialize(full = True)
+    })
@@ -0,0 +1,66 @@
+from sdmgr.db import database, job_uploads
+
+import datetime
+import uuid
+import sqlalchemy
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+# Bytes per row, small enough for a MySQL BLOB column
+UPLOAD_CHUNK_SIZE = 32768
+
+
+async def save_upload(chunks):
+    """
+    Store a stream of byte chunks (i.e. a file uploaded to an API-only
+    process) in the db a chunk at a time, for a worker's job to read back.
+    Returns the id to read it back with.
+    """
+    upload_id = uuid.uuid4().hex
+    now = datetime.datetime.now()
+    seq = 0
+    size = 0
+    async for chunk in chunks:
+        for i in range(0, len(chunk), UPLOAD_CHUNK_SIZE):
+            data = chunk[i:i + UPLOAD_CHUNK_SIZE]
+            await database.execute(job_uploads.insert().values(
+                upload_id = upload_id,
+                seq = seq,
+                data = data,
+                createdTime = now
+            ))
+            seq += 1
+            size += len(data)
+    _logger.info(f"Stored upload {upload_id} ({size} bytes in {seq} chunks).")
+    return upload_id
+
+
+async def iter_upload(upload_id):
+    """
+    Yield the chunks of a stored upload in order, reading one at a time.
+    """
+    seq = 0
+    while True:
+        row = await database.fetch_one(job_uploads.select().where(sqlalchemy.and_(
+            job_uploads.c.upload_id == upload_id,
+            job_uploads.c.seq == seq
+        )))
+        if row is None:
+            return
+        yield bytes(row['data'])
+        seq += 1
+
+
+async def delete_upload(upload_id):
+    await database.execute(job_uploads.delete().where(job_uploads.c.upload_id == upload_id))
+
+
+
+async def delete_uploads_before(when):
+    """
+    Remove uploads stored before 'when', i.e. those of jobs that were
+    abandoned before reading them.
+    """
+    await database.execute(job_uploads.delete().where(job_uploads.c.createdTime < when))
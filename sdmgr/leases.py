@@ -0,0 +1,152 @@
+from sdmgr.db import database, ManagerLease, ManagerReplica
+
+import math
+import datetime
+import sqlalchemy
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class ShardLeases:
+    """
+    Splits the domains between manager replicas. Domains are divided into a
+    fixed number of shards by id, and each replica holds time-limited
+    leases on its share of the shards in the 'manager_leases' table. A
+    replica that stops renewing its leases has its shards taken over by
+    the others once the leases expire.
+
+    Each replica also records a heartbeat in the 'manager_replicas' table
+    when renewing, even if it holds no leases (or leasing is disabled), so
+    that the live replicas are known for splitting the shards and for
+    taking over the jobs of replicas that have gone away.
+
+    Lease times are compared using each replica's own clock, so replicas'
+    clocks should be kept in sync.
+    """
+
+    def __init__(self, owner, shard_count, lease_secs):
+        self.owner = owner
+        self.shard_count = shard_count
+        self.lease_secs = lease_secs
+        self.owned = set()
+        self.live_owners = set()
+        self.changed = True
+
+    @property
+    def enabled(self):
+        return self.shard_count > 0
+
+    def shard_for(self, domain_id):
+        return domain_id % self.shard_count
+
+    def owns(self, domain_id):
+        if not self.enabled:
+            return True
+        return self.shard_for(domain_id) in self.owned
+
+    async def _ensure_shards(self):
+        existing = set(lease.shard for lease in await ManagerLease.objects.all())
+        for shard in range(self.shard_count):
+            if shard in existing:
+                continue
+            try:
+                await ManagerLease.objects.create(shard = shard, owner = None, expires = None)
+            except Exception as e:
+                # Another replica probably created it first
+                _logger.debug(f"Could not create lease for shard {shard}: {e}")
+
+    async def _fetch_leases(self):
+        leases = await ManagerLease.objects.all()
+        return [lease for lease in leases if lease.shard < self.shard_count]
+
+    async def heartbeat(self):
+        """
+        Record that we're still running, and find which other replicas are.
+        """
+        now = datetime.datetime.now()
+        expires = now + datetime.timedelta(seconds = self.lease_secs)
+        table = ManagerReplica.__table__
+
+        row = await database.fetch_one(table.select().where(table.c.owner == self.owner))
+        if row is None:
+            await ManagerReplica.objects.create(owner = self.owner, expires = expires)
+        else:
+            await database.execute(table.update().where(
+                table.c.owner == self.owner
+            ).values(expires = expires))
+
+        # Forget replicas that have been gone for a while
+        await database.execute(table.delete().where(
+            table.c.expires < now - datetime.timedelta(seconds = self.lease_secs)
+        ))
+
+        rows = await database.fetch_all(table.select().where(table.c.expires > now))
+        self.live_owners = set(row['owner'] for row in rows) | set([self.owner])
+
+    async def renew(self):
+        """
+        Record our heartbeat, then extend our leases and take on or give up
+        shards so that each live replica holds a fair share of them.
+        """
+        await self.heartbeat()
+        if not self.enabled:
+            return
+
+        await self._ensure_shards()
+        now = datetime.datetime.now()
+        expires = now + datetime.timedelta(seconds = self.lease_secs)
+        table = ManagerLease.__table__
+
+        def live(lease):
+            return lease.owner is not None and lease.expires is not None and lease.expires > now
+
+        # Replicas that have just started hold no leases yet, so the shards
+        # are split between all replicas with a live heartbeat
+        leases = await self._fetch_leases()
+        fair_share = math.ceil(self.shard_count / len(self.live_owners))
+
+        # Give up any shards beyond our fair share, so that newly started
+        # replicas can pick them up
+        mine = sorted(lease.shard for lease in leases if live(lease) and lease.owner == self.owner)
+        keep, release = mine[:fair_share], mine[fair_share:]
+        if len(release) > 0:
+            _logger.info(f"Releasing {len(release)} shards for other replicas.")
+            await database.execute(table.update().where(sqlalchemy.and_(
+                table.c.shard.in_(release),
+                table.c.owner == self.owner
+            )).values(owner = None, expires = None))
+        if len(keep) > 0:
+            await database.execute(table.update().where(sqlalchemy.and_(
+                table.c.shard.in_(keep),
+                table.c.owner == self.owner
+            )).values(expires = expires))
+
+        # Claim free or expired shards, up to our fair share. If another
+        # replica gets there first, its update wins and ours matches nothing.
+        free = [lease.shard for lease in leases if not live(lease)]
+        for shard in free[:max(0, fair_share - len(keep))]:
+            await database.execute(table.update().where(sqlalchemy.and_(
+                table.c.shard == shard,
+                sqlalchemy.or_(table.c.owner == None, table.c.expires == None, table.c.expires <= now)
+            )).values(owner = self.owner, expires = expires))
+
+        # See what we ended up with
+        leases = await self._fetch_leases()
+        owned = set(lease.shard for lease in leases if live(lease) and lease.owner == self.owner)
+        if owned != self.owned:
+            _logger.info(f"Now holding leases on {len(owned)} of {self.shard_count} shards.")
+            self.changed = True
+        self.owned = owned
+
+    async def release_all(self):
+        table = ManagerReplica.__table__
+        await database.execute(table.delete().where(table.c.owner == self.owner))
+        if not self.enabled:
+            return
+        table = ManagerLease.__table__
+        await database.execute(table.update().where(
+            table.c.owner == self.owner
+        ).values(owner = None, expires = None))
+        self.owned = set()
+        self.changed = True
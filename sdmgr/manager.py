@@ -1,32 +1,87 @@
-import os
 import asyncio
 import aiodns
 import orm
-import socket
 import signal
 import datetime
+import itertools
+import ipaddress
+import collections
 
 import importlib
 
+from sdmgr import settings
 from sdmgr.db import *
+from sdmgr.checkqueue import CheckQueue
+from sdmgr.scheduler import CheckScheduler
+from sdmgr.leases import ShardLeases
+from sdmgr.jobs import JobRunner, load_job_handlers, run_step
 from sdmgr.dns_provider import DomainNotHostedException
+from sdmgr.resolver import resolver
+from sdmgr.probe import probe, domain_probes
+from sdmgr.delegation import delegation
+from sdmgr.ratelimit import budget_metrics
 
 
 import logging
 _logger = logging.getLogger(__name__)
 
-async def fetch_records_from_dns(domain, type):
+async def fetch_records_from_dns(domain, type, snapshot = None):
+    # Use the results of the latest sweep if recent enough
+    if snapshot is not None and snapshot.age() <= settings.DNS_PROBE_MAX_AGE:
+        values = snapshot.get(domain, type)
+        if values is not None:
+            return list(values)
     try:
-        resolver = aiodns.DNSResolver()
-        rr = await resolver.query(domain, type)
-        return [x.host for x in rr]
+        return await resolver.query(domain, type)
     except aiodns.error.DNSError as e:
         _logger.error(f"Fetching {type} records from DNS for {domain}: {e}")
         return []
 
-async def dns_a_record_already_set(a_record):
-    dns_a = await fetch_records_from_dns(a_record, 'A')
-    return len(dns_a) > 0 and set(dns_a) == set(hosting_ips)
+def nameserver_names(hostnames):
+    return set(x.lower().rstrip(".") for x in hostnames)
+
+async def resolve_nameserver_ips(hostnames):
+    """
+    The set of IPs for the given nameservers. Nameserver hosts are shared by
+    many zones (i.e. Route53's awsdns hosts), so their addresses are cached
+    for at least DNS_NAMESERVER_CACHE_SECS regardless of their TTL.
+    """
+    async def resolve(hostname):
+        try:
+            return await resolver.query(hostname, 'A', min_ttl = settings.DNS_NAMESERVER_CACHE_SECS)
+        except aiodns.error.DNSError as e:
+            _logger.error(f"Resolving nameserver {hostname}: {e}")
+            return []
+
+    results = await asyncio.gather(*[resolve(x) for x in nameserver_names(hostnames)])
+    return set(ip for ips in results for ip in ips)
+
+def normalise_ip(ip):
+    try:
+        return str(ipaddress.ip_address(ip))
+    except ValueError:
+        return ip
+
+def domain_a_record_names(domain):
+    """
+    The hostnames that should point at the domain's site.
+    """
+    hostnames = []
+    if domain.update_apex:
+        hostnames.append(domain.name)
+    if len(domain.update_a_records) > 0:
+        hostnames += [f"{prefix}.{domain.name}" for prefix in domain.update_a_records.split(",")]
+    return hostnames
+
+
+def checks_passed(result):
+    """
+    Whether the outcome of checking a domain (the list of status checks
+    written for it, or the exception that prevented them) is all green.
+    """
+    if isinstance(result, Exception):
+        return False
+    return all(status is not None and status.success for status in result)
 
 
 class ManagerStatusCheck:
@@ -87,6 +142,58 @@ class ManagerStatusCheck:
         _logger.info(f"Status for check '{self._check_id}' now '{self.output}'.")
 
 
+class ManagerPass:
+    """
+    Accounting for a single pass of the manager's main loop over the active
+    domains.
+    """
+    pass_id: int
+    startTime: datetime.datetime
+    endTime: datetime.datetime = None
+
+    def __init__(self, pass_id):
+        self.pass_id = pass_id
+        self.startTime = datetime.datetime.now()
+        self.endTime = None
+        self.domains = 0
+        self.processed = 0
+        self.failures = 0
+        self.skipped_ticks = 0
+
+    @property
+    def running(self):
+        return self.endTime is None
+
+    def duration(self):
+        endTime = self.endTime or datetime.datetime.now()
+        return (endTime - self.startTime).total_seconds()
+
+    def record(self, result):
+        """
+        Record the outcome of checking a domain, which is either the list of
+        status checks for the domain or the exception that prevented it.
+        """
+        self.processed += 1
+        if not checks_passed(result):
+            self.failures += 1
+
+    def finish(self):
+        self.endTime = datetime.datetime.now()
+
+    def serialize(self):
+        return {
+            "pass_id": self.pass_id,
+            "startTime": self.startTime.isoformat(),
+            "endTime": self.endTime.isoformat() if self.endTime else None,
+            "running": self.running,
+            "duration": self.duration(),
+            "domains": self.domains,
+            "processed": self.processed,
+            "failures": self.failures,
+            "skipped_ticks": self.skipped_ticks,
+        }
+
+
 class Manager:
     def __init__(self):
         self.registrar_agents = {}
@@ -95,6 +202,18 @@ class Manager:
         self.waf_agents = {}
         self.notifiers = {}
 
+        self.check_queue = CheckQueue(self.check_domain, settings.MANAGER_WORKERS)
+        self.scheduler = CheckScheduler(settings.MANAGER_CHECK_INTERVAL_MIN, settings.MANAGER_CHECK_JITTER)
+
+        self.pass_ids = itertools.count(1)
+        self.passes = collections.deque(maxlen = settings.MANAGER_PASS_HISTORY)
+        self.current_pass = None
+        self.snapshot = None
+        self.hosting_ips_cache = {}
+
+        self.jobs = JobRunner(self, settings.JOB_WORKERS, settings.JOB_MAX_ATTEMPTS, settings.JOB_RETENTION_SECS)
+        self.leases = ShardLeases(self.jobs.owner, settings.MANAGER_SHARDS, settings.MANAGER_LEASE_SECS)
+
         # TODO: Connect to Google to fetch/verify the GSV codes via API?
 
     async def __init_agents(self):
@@ -171,8 +290,51 @@ class Manager:
             "waf": len(self.waf_agents)
         }
 
+        # Domain check work queue
+        metrics["check_queue"] = self.check_queue.metrics()
+
+        # Domain check schedule
+        metrics["scheduler"] = self.scheduler.metrics()
+        if self.leases.enabled:
+            metrics["leases"] = {
+                "owned_shards": len(self.leases.owned),
+                "total_shards": self.leases.shard_count,
+                "live_replicas": len(self.leases.live_owners),
+            }
+
+        # Most recently completed pass of the main loop
+        completed = [p for p in self.passes if not p.running]
+        if len(completed) > 0:
+            metrics["last_pass"] = completed[-1].serialize()
+        metrics["pass_running"] = int(self.current_pass is not None and self.current_pass.running)
+
+        # Shared DNS resolver cache, and sweeps of the domains due for checks
+        metrics["dns_cache"] = resolver.metrics()
+        metrics["dns_probe"] = probe.metrics()
+
+        # DNS provider agent activity (i.e. pending changes), by agent
+        metrics["dns_agents"] = {
+            agent.label: agent.metrics() for agent in self.dns_agents.values()
+        }
+
+        # Outbound request budgets, by agent
+        metrics["agent_budgets"] = budget_metrics()
+
+        # Background jobs, by state
+        metrics["jobs"] = await self.jobs.metrics()
+
         return metrics
 
+    def get_agent(self, agent_type, id):
+        agents = {
+            "registrar": self.registrar_agents,
+            "dns": self.dns_agents,
+            "hosting": self.hosting_agents,
+            "waf": self.waf_agents,
+            "notifier": self.notifiers,
+        }
+        return agents[agent_type][id]
+
     async def _fetch_dns_agent(self, domain):
         try:
             return (self.dns_agents[domain.dns.id], None)
@@ -184,20 +346,121 @@ class Manager:
     # Manager main loop, repeated regularly to keep an eye on things
     async def main_loop(self):
         """
-        Check all active domains in a certain order. Intended to be run on a schedule.
+        Queue the active domains that are due to be checked, most overdue
+        first, and wait for the checks to complete. Intended to be run on a
+        regular tick. Returns the pass record, which can also be found in
+        the list of recent passes.
         """
-        _logger.info(f"Checking all active domains...")
+        current_pass = ManagerPass(next(self.pass_ids))
+        self.current_pass = current_pass
+        self.passes.append(current_pass)
+        _logger.debug(f"Starting pass {current_pass.pass_id}...")
 
         try:
-            # Get list of known domains (in our state db)...
-            domains = await Domain.objects.filter(active=True).all()
-            _logger.info(f"Checking {len(domains)} active domains.")
-            for domain in domains:
-                asyncio.create_task(self.check_domain(domain))
+            # Pick up any domains added/removed since we last looked, or
+            # moved to/from this replica
+            now = datetime.datetime.now()
+            if self.scheduler.needs_reload(now) or self.leases.changed:
+                self.leases.changed = False
+                await self.scheduler.load(self.leases.owns)
+            else:
+                await self.scheduler.pick_up_resets(now, self.leases.owns)
+
+            # Get the domains due for checking (from our state db)...
+            limit = self.scheduler.pass_limit(settings.MANAGER_TICK_SECS)
+            due_ids = [id for id in self.scheduler.pop_due(now, limit) if self.leases.owns(id)]
+            domains = await self._fetch_active_domains(due_ids)
+            current_pass.domains = len(domains)
+            _logger.info(f"Pass {current_pass.pass_id} queueing {len(domains)} due domains for checks.")
+
+            # Look up the DNS records for all the domains in one sweep, for
+            # the checks to read from
+            if len(domains) > 0:
+                try:
+                    self.snapshot = await probe.sweep(domains)
+                except Exception as e:
+                    _logger.exception(e)
+
+            async def check(domain):
+                try:
+                    result = await self.check_queue.put(domain.id, domain)
+                except Exception as e:
+                    result = e
+                current_pass.record(result)
+                await self._reschedule_domain(domain, result)
+
+            await asyncio.gather(*[check(domain) for domain in domains])
+
+        except Exception as e:
+            _logger.exception(e)
+
+        finally:
+            current_pass.finish()
+            _logger.info(f"Finished pass {current_pass.pass_id} over {current_pass.processed} domains in {current_pass.duration():.1f} secs ({current_pass.failures} failures).")
+
+        return current_pass
 
+    async def fetch_delegated_ns(self, domain):
+        if settings.DNS_NS_CHECK_MODE == "authoritative":
+            try:
+                return list(await delegation.get_delegation(domain.name))
+            except Exception as e:
+                _logger.warning(f"Falling back to recursive NS lookup for {domain.name}: {e}")
+        return await self.lookup(domain.name, 'NS')
+
+    async def lookup(self, hostname, type):
+        return await fetch_records_from_dns(hostname, type, self.snapshot)
+
+    async def _fetch_active_domains(self, domain_ids, chunk_size = 500):
+        """
+        Load the given domains, in the order given, skipping any that have
+        since been removed or deactivated.
+        """
+        domains = []
+        for i in range(0, len(domain_ids), chunk_size):
+            chunk = domain_ids[i:i + chunk_size]
+            domains += await Domain.objects.filter(id__in=chunk, active=True).all()
+        order = {domain_id: i for i, domain_id in enumerate(domain_ids)}
+        return sorted(domains, key=lambda d: order[d.id])
+
+    def _next_check_interval(self, domain, healthy):
+        """
+        Domains that keep passing their checks are checked less and less
+        often, up to the configured ceiling. Any failure drops the domain
+        back to the minimum interval.
+        """
+        floor = settings.MANAGER_CHECK_INTERVAL_MIN
+        ceiling = max(floor, settings.MANAGER_CHECK_INTERVAL_MAX)
+        if not healthy or domain.check_interval is None:
+            return floor
+        interval = int(domain.check_interval * settings.MANAGER_CHECK_BACKOFF)
+        return min(ceiling, max(floor, interval))
+
+    async def _reschedule_domain(self, domain, result):
+        check_interval = self._next_check_interval(domain, checks_passed(result))
+        next_check_at = self.scheduler.next_check_time(datetime.datetime.now(), check_interval)
+        self.scheduler.schedule(domain.id, next_check_at)
+        try:
+            await domain.update(
+                check_interval = check_interval,
+                next_check_at = next_check_at
+            )
         except Exception as e:
             _logger.exception(e)
 
+    async def reset_domain_check_interval(self, domain):
+        """
+        Check the domain again as soon as possible, and return it to the
+        minimum check interval. Used when a domain's settings are changed.
+        The replica (or worker) checking the domain picks up the change
+        from the db on its next tick.
+        """
+        now = datetime.datetime.now()
+        self.scheduler.schedule(domain.id, now)
+        await domain.update(
+            check_interval = settings.MANAGER_CHECK_INTERVAL_MIN,
+            next_check_at = now
+        )
 
     async def check_domain(self, domain):
         """
@@ -209,17 +472,30 @@ class Manager:
         tasks = []
 
         # First, check the domain NS records are set correctly
-        tasks.append(asyncio.create_task(self.check_domain_ns_records(domain)))
+        tasks.append(("ns_records", asyncio.create_task(self.check_domain_ns_records(domain))))
 
         # Then, check that A records are set correctly
-        #tasks.append(asyncio.create_task(self.check_domain_a_records(domain)))
+        tasks.append(("a_records", asyncio.create_task(self.check_domain_a_records(domain))))
         # [TODO] Other checks...
 
-        for task in tasks:
+        results = []
+        for check_id, task in tasks:
             try:
-                await task
+                results.append(await task)
             except Exception as e:
+                # A check that couldn't complete is a failed check, not one
+                # to leave out
                 _logger.exception(e)
+                results.append(await self._record_check_failure(domain, check_id, e))
+        return results
+
+    async def _record_check_failure(self, domain, check_id, e):
+        status = ManagerStatusCheck("domain", domain.name, check_id)
+        try:
+            return await status.error(f"Check failed: {e.__class__.__name__}: {e}")
+        except Exception as e:
+            _logger.exception(e)
+            return None
 
     async def apply_domain(self, domain):
         """
@@ -238,6 +514,16 @@ class Manager:
             except Exception as e:
                 _logger.exception(e)
 
+        # The records may have just changed, so checks that follow shouldn't
+        # read the answers from before
+        self.forget_domain_records(domain)
+
+    def forget_domain_records(self, domain):
+        for hostname, type in domain_probes(domain):
+            if self.snapshot is not None:
+                self.snapshot.forget(hostname)
+            resolver.forget(hostname, type)
+
     async def check_domain_ns_records(self, domain):
         status = ManagerStatusCheck("domain", domain.name, "ns_records")
 
@@ -246,19 +532,16 @@ class Manager:
         if error is not None:
             return await status.error(error)
 
-        def resolve(hostname):
-            return socket.gethostbyname(hostname)
-
         # Fetch the records the DNS provider says they should be set to
         try:
             _logger.debug(f"Retrieving intended NS records for {domain.name} from {dns_agent.label}...")
             agent_ns = await dns_agent.get_ns_records(domain.name)
             if len(agent_ns) < 1:
                 return await status.error(f"DNS provider for domain '{domain.name}' has no NS records.")
-            agent_ns_resolved = [resolve(x) for x in agent_ns]
 
         except DomainNotHostedException as dnhe:
             await self.create_missing_dns_zone(domain)
+            return await status.error(f"Domain '{domain.name}' was not hosted with {dns_agent.label}. Requested creation of DNS zone.")
 
         except Exception as e:
             _logger.exception(e)
@@ -267,12 +550,19 @@ class Manager:
         # What do public nameservers tell us the NS are currently set to?
         try:
             _logger.debug(f"Retrieving actual NS records for {domain.name} from DNS...")
-            dns_ns = await fetch_records_from_dns(domain.name, 'NS')
-            dns_ns_resolved = [resolve(x) for x in dns_ns]
+            dns_ns = await self.fetch_delegated_ns(domain)
+
+            matched = await self.ns_records_match(agent_ns, dns_ns)
+
+            # The provider's records may come from a snapshot that's out of
+            # date (i.e. changed outside sdmgr), so fetch them afresh before
+            # deciding they don't match
+            if not matched and dns_agent.forget_cached_records(domain.name):
+                agent_ns = await dns_agent.get_ns_records(domain.name)
+                matched = await self.ns_records_match(agent_ns, dns_ns)
 
             # If they don't match, action will be required.
-            if len(dns_ns) <= 0 or set(agent_ns_resolved) != set(dns_ns_resolved):
-                agent_ns_list = ",".join(agent_ns)
+            if not matched:
                 await domain.registrar.load()
                 await self.update_ns_records_with_registrar(domain, agent_ns)
                 return await status.error(f"NS records set incorrectly. Please check settings with registrar {domain.registrar.label}.")
@@ -285,37 +575,64 @@ class Manager:
         _logger.info(f"NS records match records from {dns_agent.label} for {domain.name}.")
         return await status.success()
 
+    async def ns_records_match(self, agent_ns, dns_ns):
+        # Matching hostnames are the common case, so only resolve the
+        # nameservers to IPs (i.e. aliases of the same servers) if not.
+        if len(dns_ns) < 1:
+            return False
+        if nameserver_names(agent_ns) == nameserver_names(dns_ns):
+            return True
+        agent_ns_resolved = await resolve_nameserver_ips(agent_ns)
+        dns_ns_resolved = await resolve_nameserver_ips(dns_ns)
+        return len(agent_ns_resolved) > 0 and agent_ns_resolved == dns_ns_resolved
+
     async def check_domain_a_records(self, domain):
         status = ManagerStatusCheck("domain", domain.name, "a_records")
         (dns_agent, error) = await self._fetch_dns_agent(domain)
         if error is not None:
             return await status.error(error)
 
+        # Domains not (yet) pointed at a site have nothing to compare with
+        if domain.site is None or domain.site.id is None:
+            return await status.success("No site configured.")
+
         hosting_ips = await self.fetch_hosting_ips_for_domain(domain)
         if len(hosting_ips) < 1:
             return await status.error(f"No hosting IPs found.")
 
-        # Check/manage apex record
-        if domain.update_apex:
-            a_record = domain.name
-            if await dns_a_record_already_set(a_record):
-                _logger.debug(f"DNS apex record with {dns_agent.label} resolves to expected hosting IPs.")
-            else:
-                return await status.error(f"DNS apex record with {dns_agent.label} does not resolve to expected hosting IPs.")
-
-        # Check/manage additional 'A' records as specified (typically 'www')
-        if len(domain.update_a_records) > 0:
-            for prefix in domain.update_a_records.split(","):
-                a_record = f"{prefix}.{domain.name}"
-                if await dns_a_record_already_set(a_record):
-                    _logger.debug(f"DNS A record for '{a_record}' with {dns_agent.label} resolves to expected hosting IPs.")
-                else:
-                    return await status.error(f"DNS A record for '{a_record}' does not resolve to expected hosting IPs.")
+        # Resolve the apex and each additional record (typically 'www') at
+        # the same time, and compare each with the hosting IPs
+        hostnames = domain_a_record_names(domain)
+        diffs = await asyncio.gather(*[self.diff_a_records(x, hosting_ips) for x in hostnames])
+        mismatched = [(hostname, diff) for hostname, diff in zip(hostnames, diffs) if diff is not None]
+
+        if len(mismatched) > 0:
+            details = "; ".join(
+                f"{hostname} missing [{', '.join(sorted(missing))}] unexpected [{', '.join(sorted(unexpected))}]"
+                for hostname, (missing, unexpected) in mismatched
+            )
+            return await status.error(f"DNS records with {dns_agent.label} do not resolve to expected hosting IPs: {details}")
 
         # Otherwise, things look hunky-dorey A record wise.
-        _logger.info(f"A records resolve to expected hosting IPs.")
+        _logger.info(f"A records for {domain.name} resolve to expected hosting IPs.")
         return await status.success()
 
+    async def diff_a_records(self, hostname, hosting_ips):
+        """
+        Compare the A (and AAAA, if any IPv6 hosting IPs) records for the
+        hostname with the hosting IPs. Returns None if they match, otherwise
+        the (missing, unexpected) sets of IPs.
+        """
+        expected = set(normalise_ip(x) for x in hosting_ips)
+        types = ['A']
+        if any(":" in x for x in expected):
+            types.append('AAAA')
+        results = await asyncio.gather(*[self.lookup(hostname, type) for type in types])
+        actual = set(normalise_ip(x) for values in results for x in values)
+        if actual == expected:
+            return None
+        return (expected - actual, actual - expected)
+
     async def apply_domain_a_records(self, domain):
         (dns_agent, error) = await self._fetch_dns_agent(domain)
         if error is not None:
@@ -325,24 +642,26 @@ class Manager:
         if len(hosting_ips) < 1:
             return f"No hosting IPs found."
 
-        # Check/manage apex record
-        if domain.update_apex:
-            a_record = domain.name
-            _logger.info(f"Updating DNS apex record '{a_record}' with {dns_agent.label}...")
-            await dns_agent.create_new_a_rr(domain, a_record, hosting_ips)
+        # Update the apex and additional records (typically 'www') together,
+        # so the DNS provider can send them as one change
+        async def update(a_record):
+            _logger.info(f"Updating DNS A record '{a_record}' with {dns_agent.label}...")
+            await run_step(f"a_record:{a_record}", dns_agent.create_new_a_rr, domain, a_record, hosting_ips)
 
-        # Check/manage additional 'A' records as specified (typically 'www')
-        if len(domain.update_a_records) > 0:
-            for prefix in domain.update_a_records.split(","):
-                a_record = f"{prefix}.{domain.name}"
-                _logger.info(f"Updating DNS A record '{a_record}' with {dns_agent.label}...")
-                await dns_agent.create_new_a_rr(domain, a_record, hosting_ips)
+        await asyncio.gather(*[update(x) for x in domain_a_record_names(domain)])
 
     async def check_domain_google_site_verification(self, domain):
         if domain.google_site_verification is not None:
             _logger.debug(f"Checking Google Site Verification code for {domain.name}...")
+
+            # Only go to the DNS provider if the code isn't already published
+            expected = f"google-site-verification={domain.google_site_verification}"
+            if expected in await self.lookup(domain.name, 'TXT'):
+                return
+
             agent = self.dns_agents[domain.dns.id]
             await agent.set_google_site_verification(domain)
+            self.forget_domain_records(domain)
 
     # TODO: Complete...
     async def check_domain_contacts(self, domain):
@@ -462,14 +781,30 @@ class Manager:
         return aliases
 
     async def fetch_hosting_ips_for_domain(self, domain):
-        if domain.site.id is None:
+        """
+        The IPs the domain should resolve to: those of the WAF if it has
+        one, otherwise those of the site's hosting. These are cached for a
+        tick, as many domains share a site.
+        """
+        if domain.site is None or domain.site.id is None:
             return []
-        if domain.waf.id is not None:
+        use_waf = domain.waf is not None and domain.waf.id is not None
+        key = ("waf", domain.waf.id, domain.site.id) if use_waf else ("hosting", domain.site.id)
+        cached = self.hosting_ips_cache.get(key)
+        if cached is not None and cached[0] > datetime.datetime.now():
+            return cached[1]
+
+        site = await Site.objects.get(id = domain.site.id)
+        if use_waf:
             waf_agent = self.waf_agents[domain.waf.id]
-            return await waf_agent.fetch_ips_for_site(domain.site)
+            ips = await waf_agent.fetch_ips_for_site(site)
         else:
-            hosting_agent = self.hosting_agents[domain.site.hosting.id]
-            return await hosting_agent.fetch_ips_for_site(domain.site)
+            hosting_agent = self.hosting_agents[site.hosting.id]
+            ips = await hosting_agent.fetch_ips_for_site(site)
+
+        expires = datetime.datetime.now() + datetime.timedelta(seconds = settings.MANAGER_TICK_SECS)
+        self.hosting_ips_cache[key] = (expires, ips)
+        return ips
 
     async def get_current_aliases_for_site(self, site):
         hosting_agent = self.hosting_agents[site.hosting.id]
@@ -484,18 +819,44 @@ class Manager:
             # Create an instance for each agent
             await self.__init_agents()
 
+            # Take our share of the domains from any other replicas
+            await self.leases.renew()
+
+            # Pick up any jobs left unfinished by the last process, and any
+            # submitted from here on
+            load_job_handlers()
+            await self.jobs.start(settings.JOB_POLL_SECS, self.leases.live_owners)
+
+            # Keep our heartbeat and leases, and take over from any replicas
+            # that stop
+            async def lease_loop(frequency):
+                while True:
+                    await asyncio.sleep(frequency)
+                    try:
+                        await self.leases.renew()
+                        await self.jobs.resume(self.leases.live_owners)
+                    except Exception as e:
+                        _logger.exception(e)
+
+            asyncio.create_task(lease_loop(settings.MANAGER_LEASE_SECS / 3))
+
             # Prepare the main manager loop
             async def monitoring_loop(frequency):
-                _logger.info(f"Starting monitoring event loop, to run every {frequency} secs.")
+                _logger.info(f"Starting monitoring event loop, to tick every {frequency} secs and check each domain every {settings.MANAGER_CHECK_INTERVAL_MIN}-{settings.MANAGER_CHECK_INTERVAL_MAX} secs.")
                 try:
                     while True:
-                        asyncio.create_task(self.main_loop())
+                        # Don't let a slow pass overlap with the next one
+                        if self.current_pass is not None and self.current_pass.running:
+                            self.current_pass.skipped_ticks += 1
+                            _logger.warning(f"Pass {self.current_pass.pass_id} still running after {self.current_pass.duration():.1f} secs. Skipping this tick.")
+                        else:
+                            asyncio.create_task(self.main_loop())
                         await asyncio.sleep(frequency)
                 except Exception as e:
                     _logger.exception(e)
 
-            frequency = int(os.getenv("MANAGER_LOOP_SECS", "0"))
-            if frequency > 0:
+            if settings.MANAGER_LOOP_SECS > 0:
+                frequency = min(settings.MANAGER_TICK_SECS, settings.MANAGER_LOOP_SECS)
                 asyncio.create_task(monitoring_loop(frequency))
 
         except Exception as e:
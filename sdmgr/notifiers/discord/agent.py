@@ -1,11 +1,12 @@
 from ..base import NotifierAgent
+from sdmgr.ratelimit import RateLimitedException
 
 import logging
 _logger = logging.getLogger(__name__)
 
 import os
+import json
 import aiohttp
-import asyncio
 
 
 class Discord(NotifierAgent):
@@ -18,55 +19,41 @@ class Discord(NotifierAgent):
         },
     ]
 
+    # Discord allows webhooks 5 requests every 2 seconds
+    _rate_limit_ = 2.5
+    _rate_burst_ = 5
+
     def __init__(self, data, manager):
         _logger.info(f"Loading Discord notifier agent (id: {data.id}): {data.label})")
         NotifierAgent.__init__(self, data, manager)
 
-    async def notify_registrar_ns_update(self, registrar, domain, nameservers):
-        content = f"Please update NS records for domain `{domain.name}` to: "
-        content += "```" + ("\n".join(nameservers)) + "```"
-        data = {
-            'username': registrar.label,
-            'content': content
-        }
-        async with aiohttp.ClientSession() as session:
-            webhook_url = self._config("webhook_url")
-            while True:
-                async with session.post(webhook_url, data=data) as response:
-                    output = await response.text()
-                    if response.status == 429:
-                        # Handle rate limitting
-                        r = json.loads(output)
-                        waitfor = (int(int(r['retry_after']) / 1000) * 1000) + 1
-                        _logger.warning(f"Rate limit from Discord API. Retry after {waitfor} secs.")
-                        asyncio.sleep(waitfor)
-                        continue
-                    if response.status != 204:
-                        _logger.error(f"Unexpected response from Discord API ({response.status}): {output}")
-                    break
-
-    async def notify_domain_transfer_out(self, domain, old_registrar, new_registrar):
-        content = f"Domain `{domain.name}` has been transfered out of '{old_registrar.label}' to '{new_registrar.label}'."
+    async def _post(self, username, content):
         data = {
-            'username': old_registrar.label,
+            'username': username,
             'content': content
         }
         async with aiohttp.ClientSession() as session:
             webhook_url = self._config("webhook_url")
             async with session.post(webhook_url, data=data) as response:
                 output = await response.text()
+                if response.status == 429:
+                    # Handle rate limitting (retry_after is in millisecs)
+                    retry_after = response.headers.get("Retry-After")
+                    if retry_after is None:
+                        retry_after = json.loads(output)['retry_after'] / 1000
+                    raise RateLimitedException("Rate limit from Discord API.", float(retry_after))
                 if response.status != 204:
                     _logger.error(f"Unexpected response from Discord API ({response.status}): {output}")
 
+    async def notify_registrar_ns_update(self, registrar, domain, nameservers):
+        content = f"Please update NS records for domain `{domain.name}` to: "
+        content += "```" + ("\n".join(nameservers)) + "```"
+        await self.budget.call(self._post, registrar.label, content)
+
+    async def notify_domain_transfer_out(self, domain, old_registrar, new_registrar):
+        content = f"Domain `{domain.name}` has been transfered out of '{old_registrar.label}' to '{new_registrar.label}'."
+        await self.budget.call(self._post, old_registrar.label, content)
+
     async def notify_domain_transfer_in(self, domain, old_registrar, new_registrar):
         content = f"Domain `{domain.name}` has been transfered in from '{old_registrar.label}' to '{new_registrar.label}'."
-        data = {
-            'username': new_registrar.label,
-            'content': content
-        }
-        async with aiohttp.ClientSession() as session:
-            webhook_url = self._config("webhook_url")
-            async with session.post(webhook_url, data=data) as response:
-                output = await response.text()
-                if response.status != 204:
-                    _logger.error(f"Unexpected response from Discord API ({response.status}): {output}")
+        await self.budget.call(self._post, new_registrar.label, content)
@@ -0,0 +1,121 @@
+from sdmgr import settings
+from sdmgr.resolver import resolver as shared_resolver
+
+import aiodns
+import asyncio
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class ProbeSnapshot:
+    """
+    The DNS records found for a set of hostnames by a single sweep, keyed by
+    hostname and then record type. Lookups that failed with an error other
+    than a definite answer (i.e. timeouts) are left out, so that checks fall
+    back to a live lookup for them.
+    """
+
+    def __init__(self):
+        self.taken = time.monotonic()
+        self.records = {}
+
+    def add(self, hostname, type, values):
+        self.records.setdefault(hostname.lower().rstrip("."), {})[type] = values
+
+    def get(self, hostname, type):
+        """
+        The values found for the hostname and type, or None if unknown.
+        """
+        return self.records.get(hostname.lower().rstrip("."), {}).get(type)
+
+    def forget(self, hostname):
+        self.records.pop(hostname.lower().rstrip("."), None)
+
+    def age(self):
+        return time.monotonic() - self.taken
+
+
+class RateLimiter:
+    """
+    Spaces out calls to 'acquire' to no more than 'rate' per second.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_time = 0
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        wait = self.next_time - now
+        self.next_time = max(now, self.next_time) + 1 / self.rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def domain_probes(domain):
+    """
+    The (hostname, type) lookups needed by the checks for a domain.
+    """
+    probes = [(domain.name, type) for type in ('NS', 'A', 'AAAA', 'TXT')]
+    if len(domain.update_a_records) > 0:
+        for prefix in domain.update_a_records.split(","):
+            probes += [(f"{prefix}.{domain.name}", type) for type in ('A', 'AAAA')]
+    return probes
+
+
+class DNSProbe:
+    """
+    Sweeps the DNS records for many domains at once, keeping up to
+    'concurrency' lookups in flight on each of the resolver's channels and
+    sending no more than 'qps' lookups a second overall.
+    """
+
+    def __init__(self, resolver, qps, concurrency):
+        self.resolver = resolver
+        self.limiter = RateLimiter(qps)
+        self.concurrency = concurrency
+        self.sweeps = 0
+        self.lookups = 0
+        self.errors = 0
+        self.last_duration = 0
+
+    async def sweep(self, domains):
+        snapshot = ProbeSnapshot()
+        probes = set(probe for domain in domains for probe in domain_probes(domain))
+        semaphore = asyncio.Semaphore(max(1, self.concurrency * self.resolver.pool_size))
+
+        async def probe(hostname, type):
+            async with semaphore:
+                await self.limiter.acquire()
+                self.lookups += 1
+                try:
+                    snapshot.add(hostname, type, await self.resolver.query(hostname, type))
+                except aiodns.error.DNSError as e:
+                    # Definite answers (i.e. NXDOMAIN) are as good as empty
+                    if len(e.args) > 0 and e.args[0] in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA):
+                        snapshot.add(hostname, type, [])
+                    else:
+                        self.errors += 1
+
+        start = time.monotonic()
+        await asyncio.gather(*[probe(hostname, type) for hostname, type in probes])
+        self.last_duration = time.monotonic() - start
+        self.sweeps += 1
+        _logger.info(f"Probed {len(probes)} DNS records for {len(domains)} domains in {self.last_duration:.1f} secs.")
+        return snapshot
+
+    def metrics(self):
+        return {
+            "sweeps": self.sweeps,
+            "lookups": self.lookups,
+            "errors": self.errors,
+            "last_duration": self.last_duration,
+        }
+
+
+# Singleton, sharing the resolver (and its cache) with the checks
+probe = DNSProbe(shared_resolver, settings.DNS_PROBE_QPS, settings.DNS_PROBE_CONCURRENCY)
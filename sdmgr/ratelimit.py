@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class RateLimitedException(Exception):
+    """
+    Raised by agents when a provider turns a request away for exceeding its
+    rate limits (i.e. HTTP 429, or AWS throttling), optionally with how long
+    (in seconds) the provider asks us to wait.
+    """
+    def __init__(self, message = "Rate limited", retry_after = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def check_rate_limit(response, provider):
+    """
+    Raise RateLimitedException if an (aiohttp) response is a HTTP 429, with
+    the wait the provider asks for in its Retry-After header, if any.
+    """
+    if response.status != 429:
+        return
+    try:
+        retry_after = float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        retry_after = None
+    raise RateLimitedException(f"Rate limit from {provider} API.", retry_after)
+
+
+class TokenBucket:
+    """
+    Allows 'rate' calls a second on average, in bursts of up to 'burst'.
+    Starts full, or if not 'full', empty (i.e. so a restart right after a
+    burst doesn't allow another).
+    """
+
+    def __init__(self, rate, burst, full = True):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst if full else 0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """
+        Wait for a token, returning how long (in seconds) we waited.
+        """
+        waited = 0
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def pause(self, secs):
+        # Hold off all callers, i.e. when the provider asks us to back off
+        self._refill()
+        self.tokens = min(self.tokens, 1 - secs * self.rate)
+
+
+class AgentBudget:
+    """
+    The outbound request budget of a single agent: a token bucket for its
+    request rate (if limited) and a semaphore for the number of requests in
+    progress at once (if limited). Use as an async context manager around a
+    request, or via 'call' to also retry requests that were rate limited.
+    """
+
+    def __init__(self, key, rate = None, burst = 1, concurrency = None, max_retries = 5, backoff = 1.0, full = True):
+        self.key = key
+        self.bucket = TokenBucket(rate, burst, full) if rate else None
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.calls = 0
+        self.wait_seconds = 0
+        self.rejections = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def __aenter__(self):
+        start = time.monotonic()
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+        try:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+        except BaseException:
+            if self.semaphore is not None:
+                self.semaphore.release()
+            raise
+        self.wait_seconds += time.monotonic() - start
+        self.calls += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) within the budget, retrying with
+        exponential backoff (or as long as the provider asks) when it
+        raises RateLimitedException.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self:
+                    return await func(*args, **kwargs)
+            except RateLimitedException as e:
+                self.rejections += 1
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failures += 1
+                    raise
+                delay = e.retry_after
+                if delay is None:
+                    delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(1, 1.5)
+                if self.bucket is not None:
+                    self.bucket.pause(delay)
+                self.retries += 1
+                _logger.warning(f"Rate limited by provider for {self.key}. Retrying in {delay:.1f} secs (attempt {attempt}).")
+                await asyncio.sleep(delay)
+
+    def metrics(self):
+        return {
+            "calls": self.calls,
+            "wait_seconds": self.wait_seconds,
+            "rejections": self.rejections,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+
+# Budgets of all agents, keyed by agent (i.e. 'dns:1')
+budgets = {}
+
+def get_budget(key, rate = None, burst = 1, concurrency = None, full = True):
+    if key not in budgets:
+        budgets[key] = AgentBudget(key, rate, burst, concurrency, full = full)
+    return budgets[key]
+
+def budget_metrics():
+    return {key: budget.metrics() for key, budget in budgets.items()}
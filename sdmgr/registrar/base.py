@@ -1,10 +1,12 @@
-from sdmgr.db import Registrar, RegistrarNotifier, Domain
+from sdmgr.db import database, Registrar, RegistrarNotifier, Domain
 from sdmgr.agent import BaseAgent
+from sdmgr.domains.bulk import fetch_domain_map, insert_domains, update_domains
+from sdmgr.registrar.streaming import iter_batches
+from sdmgr import settings
 
 import logging
 _logger = logging.getLogger(__name__)
 
-import orm
 import datetime
 
 
@@ -42,44 +44,116 @@ class RegistrarAgent(BaseAgent):
     async def get_status_for_domain(self, domainname):
         raise NotImplementedError
 
-    async def _populate_domains(self):
+    async def _populate_domains(self, domainnames = None):
+        """
+        Make sure the state db has a domain for each of the registrar's
+        domains (or the given subset of them), associated with this
+        registrar. Errors are logged rather than raised. Returns counts of
+        domains created, moved and unchanged.
+        """
         try:
-            registrar = await Registrar.objects.get(id = self.id)
-            domainnames = await self.get_registered_domains()
-            _logger.info(f"Checking for new domains in {len(domainnames)} domains from recent update...")
-            for domainname in domainnames:
-                _logger.debug(f"Checking {domainname}...")
-                try:
-                    domain = await Domain.objects.get(name=domainname)
-                    if domain.registrar.id == registrar.id:
-                        _logger.debug(f"Found {domainname}.")
-                    else:
-                        _logger.info(f"Reassociating '{domainname}' with registrar '{registrar.label}'.")
-                        await domain.registrar.load()
-                        await domain.update(registrar = registrar)
-                        try:
-                            old_registrar_agent = self.manager.registrar_agents[domain.registrar.id]
-                            await old_registrar_agent.notify_domain_transfer_out(domain, domain.registrar, registrar)
-                        except KeyError as e:
-                            pass
-                        except Exception as e:
-                            _logger.exception(e)
-                        try:
-                            new_registrar_agent = self.manager.registrar_agents[registrar.id]
-                            await new_registrar_agent.notify_domain_transfer_in(domain, domain.registrar, registrar)
-                        except KeyError as e:
-                            pass
-                        except Exception as e:
-                            _logger.exception(e)
-
-                except orm.exceptions.NoMatch:
-                    domain = await Domain.objects.create(
-                        name = domainname,
-                        registrar = registrar,
-                    )
-                    _logger.info(f"Created domain '{domainname}' from registrar '{registrar.label}'.")
+            return await self._sync_domains(domainnames)
         except Exception as e:
             _logger.exception(e)
+            return {
+                "created": 0,
+                "moved": 0,
+                "unchanged": 0,
+            }
+
+    async def _sync_domains(self, domainnames = None):
+        """
+        As _populate_domains, but raising any error. New domains are
+        inserted and reassigned domains updated in bulk in one transaction,
+        with transfer notifications sent once committed.
+        """
+        registrar = await Registrar.objects.get(id = self.id)
+        if domainnames is None:
+            domainnames = await self.get_registered_domains()
+        domainnames = set(domainnames)
+        _logger.info(f"Checking for new domains in {len(domainnames)} domains from recent update...")
+
+        existing = await fetch_domain_map(domainnames, "registrar")
+        created = [x for x in domainnames if x not in existing]
+        moved = {existing[x][0]: existing[x][1] for x in domainnames if x in existing and existing[x][1] != registrar.id}
+
+        async with database.transaction():
+            await insert_domains(created, registrar = registrar.id)
+            await update_domains(moved.keys(), registrar = registrar.id)
+
+        counts = {
+            "created": len(created),
+            "moved": len(moved),
+            "unchanged": len(domainnames) - len(created) - len(moved),
+        }
+        _logger.info(f"Created {counts['created']}, moved {counts['moved']} and found {counts['unchanged']} unchanged domains from registrar '{registrar.label}'.")
+
+        await self._notify_domain_transfers(registrar, moved)
+        return counts
+
+    async def _import_domains(self, entries, registered_status):
+        """
+        Replace the registrar's domains with those from an import (an async
+        iterator of dicts with 'name' and 'status'), syncing the ones with
+        the registered status to the db in batches as they are read.
+        The registrar's domains are only replaced once the whole import has
+        been read, so an import that fails part way (reading it, or syncing
+        a batch) leaves them as they were and raises. Batches synced before
+        the failure stay committed. Returns counts of domains read,
+        created, moved and unchanged.
+        """
+        domains = {}
+        counts = {
+            "created": 0,
+            "moved": 0,
+            "unchanged": 0,
+        }
+        async for batch in iter_batches(entries, settings.IMPORT_BATCH_SIZE):
+            for entry in batch:
+                domains[entry['name']] = entry
+            registered = [x['name'] for x in batch if x['status'] == registered_status]
+            batch_counts = await self._sync_domains(registered)
+            for key in counts:
+                counts[key] += batch_counts[key]
+
+        # Record this in the 'state' field in the db
+        self.domains = domains
+        await self._save_state()
+
+        return {
+            "count": len(self.domains),
+            **counts
+        }
+
+    async def _notify_domain_transfers(self, registrar, moved):
+        """
+        Notify the old and new registrars of domains moved to 'registrar',
+        given as a map of domain id to old registrar id.
+        """
+        if len(moved) == 0:
+            return
+        registrars = {r.id: r for r in await Registrar.objects.all()}
+        domain_ids = list(moved.keys())
+        for i in range(0, len(domain_ids), 500):
+            for domain in await Domain.objects.filter(id__in = domain_ids[i:i + 500]).all():
+                old_registrar = registrars.get(moved[domain.id])
+                _logger.info(f"Reassociated '{domain.name}' with registrar '{registrar.label}'.")
+                if old_registrar is None:
+                    continue
+                try:
+                    old_registrar_agent = self.manager.registrar_agents[old_registrar.id]
+                    await old_registrar_agent.notify_domain_transfer_out(domain, old_registrar, registrar)
+                except KeyError as e:
+                    pass
+                except Exception as e:
+                    _logger.exception(e)
+                try:
+                    new_registrar_agent = self.manager.registrar_agents[registrar.id]
+                    await new_registrar_agent.notify_domain_transfer_in(domain, old_registrar, registrar)
+                except KeyError as e:
+                    pass
+                except Exception as e:
+                    _logger.exception(e)
 
     async def set_ns_records(self, domain, nameservers):
         registrar_notifiers = RegistrarNotifier.objects.filter(registrar = domain.registrar)
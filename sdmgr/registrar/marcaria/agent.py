@@ -1,12 +1,16 @@
 from ..base import RegistrarAgent
+from ..streaming import iter_bytes, iter_csv_rows
 
 import logging
 _logger = logging.getLogger(__name__)
 
-import csv
 import orm
 
 
+# Columns used from Marcaria's CSV export
+CSV_COLUMNS = ["Domain", "Status", "Expiration Date", "DNS Profile", "Auto-Renew"]
+
+
 class Marcaria(RegistrarAgent):
     _label_ = "Marcaria"
 
@@ -36,42 +40,50 @@ class Marcaria(RegistrarAgent):
         return "csvfile"
 
     async def update_from_csvfile(self, content):
-        csvfile = csv.reader(content.decode("utf8").replace("\n", "").split("\r"))
-        self.domains = {}
+        """
+        Update from a CSV export, given as bytes or an async stream of byte
+        chunks. Rows are parsed as they are read, and the domains synced to
+        the db in batches.
+        """
+        if isinstance(content, bytes):
+            content = iter_bytes(content)
+        rows = iter_csv_rows(content)
+
+        # Find the columns we need from the header
         header_row = None
-        for row in csvfile:
-            if len(row) <= 1:
-                continue
-            if header_row is None:
-                header_row = row
-                continue
-            p = row[4].split('/')
-            expiry_date = None
-            if len(p) == 3:
-                expiry_date = "{0:04}-{1:02}-{2:02}".format(int(p[2]), int(p[1]), int(p[0]))
-            self.domains[row[0]] = {
-                'name': row[0],
-                'status': row[1],
-                'expiry_date': expiry_date,
-                'dns_profile': row[7],
-                'auto_renew': row[8] == "ON"
-            }
-
-        if header_row == None:
+        async for row in rows:
+            header_row = row
+            break
+        if header_row is None:
             raise Exception("No data retrieved from upload. Are you sure it's the right file?")
-
+        try:
+            columns = {x: header_row.index(x) for x in CSV_COLUMNS}
+        except ValueError:
+            raise Exception(f"Unexpected header in upload, expected columns: {', '.join(CSV_COLUMNS)}")
+
+        async def entries():
+            async for row in rows:
+                if len(row) < len(header_row):
+                    continue
+                p = row[columns["Expiration Date"]].split('/')
+                expiry_date = None
+                if len(p) == 3:
+                    # i.e. '3/17/2020'
+                    expiry_date = "{0:04}-{1:02}-{2:02}".format(int(p[2]), int(p[0]), int(p[1]))
+                yield {
+                    'name': row[columns["Domain"]],
+                    'status': row[columns["Status"]],
+                    'expiry_date': expiry_date,
+                    'dns_profile': row[columns["DNS Profile"]],
+                    'auto_renew': row[columns["Auto-Renew"]] == "ON"
+                }
+
+        # Ensure domain records are present for all registered domains
+        result = await self._import_domains(entries(), "Registered")
         _logger.info(f"Updated Marcaria registrar with {len(self.domains)} domains from CSV file.")
 
-        # Record this in the 'state' field in the db
-        await self._save_state()
-
-        # Ensure domain records are present for all domains listed in this file
-        await self._populate_domains()
-
         # Return count of domains for confirmation message
-        return {
-            "count": len(self.domains)
-        }
+        return result
 
     async def get_status(self):
         active_domains = (x['name'] for x in self.domains.values() if x['status'] == "Registered")
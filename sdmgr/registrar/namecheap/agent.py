@@ -1,16 +1,21 @@
 from ..base import RegistrarAgent
+from sdmgr.ratelimit import check_rate_limit
 
 import logging
 _logger = logging.getLogger(__name__)
 
 import os
 import orm
+import asyncio
 import aiohttp
 from xml.etree import ElementTree
 
 #API_URL = "https://api.sandbox.namecheap.com"
 API_URL = "https://api.namecheap.com"
 
+# XML namespace of API responses
+NS = "{http://api.namecheap.com/xml.response}"
+
 
 class Namecheap(RegistrarAgent):
     _label_ = "Namecheap"
@@ -30,6 +35,13 @@ class Namecheap(RegistrarAgent):
         },
     ]
 
+    # Namecheap allows 20 API calls a minute (and 700 an hour). A burst
+    # plus the refill over any minute mustn't go over 20, so refill at 10
+    # a minute (600 an hour) with bursts of 10, starting empty.
+    _rate_limit_ = 10 / 60
+    _rate_burst_ = 10
+    _rate_start_full_ = False
+
     def __init__(self, data, manager):
         _logger.info(f"Loading Namecheap registrar agent (id: {data.id}): {data.label})")
         RegistrarAgent.__init__(self, data, manager)
@@ -61,37 +73,75 @@ class Namecheap(RegistrarAgent):
     async def get_refresh_method(self):
         return "api"
 
+    async def _get(self, url):
+        """
+        Make a request to the Namecheap API within the agent's budget,
+        retrying it if rate limited. Returns the response status and body.
+        """
+        return await self.budget.call(self._get_once, url)
+
+    async def _get_once(self, url):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                check_rate_limit(response, "Namecheap")
+                return (response.status, await response.text())
+
+    async def _fetch_domains_page(self, session, page_num, page_size, domains):
+        """
+        Fetch a page of the domains list, adding each domain to 'domains' as
+        it is parsed from the response. Returns the total number of domains.
+        """
+        return await self.budget.call(self._fetch_domains_page_once, session, page_num, page_size, domains)
+
+    async def _fetch_domains_page_once(self, session, page_num, page_size, domains):
+        url = self._get_url_prefix()
+        url = f"{url}&Command=namecheap.domains.getList&PageSize={page_size}&Page={page_num}"
+        _logger.info(f"Fetching Namecheap domains page {page_num}")
+
+        parser = ElementTree.XMLPullParser(events=("end",))
+        total_items = None
+        async with session.get(url) as response:
+            check_rate_limit(response, "Namecheap")
+            if response.status != 200:
+                raise Exception(f"Unexpected response from Namecheap API: {response.status}")
+            async for chunk in response.content.iter_chunked(16384):
+                parser.feed(chunk)
+                for event, element in parser.read_events():
+                    if element.tag == f"{NS}Error":
+                        raise Exception(element.text)
+                    elif element.tag == f"{NS}Domain":
+                        domains[element.attrib['Name']] = dict(element.attrib)
+                        element.clear()
+                    elif element.tag == f"{NS}TotalItems":
+                        total_items = int(element.text)
+        parser.close()
+
+        if total_items is None:
+            raise Exception(f"No TotalItems in Namecheap domains page {page_num}")
+        return total_items
+
     async def refresh(self):
         _logger.info(f"Refreshing list of domains managed on {self.label}...")
         domains = {}
-        page_num = 0
-        page_count = 1
         page_size = 100
 
-        async def get_page(page_num):
-            async with aiohttp.ClientSession() as session:
-                url = self._get_url_prefix()
-                url = f"{url}&Command=namecheap.domains.getList&PageSize={page_size}&Page={page_num}"
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        _logger.error(f"Unexpected response from Namecheap API: {response.status}")
-                        return
-                    xmlstring = await response.text()
-            return xmlstring
-
-        while page_num < page_count:
-            page_num += 1
-            _logger.info(f"Fetching Namecheap domains page {page_num}")
-            xmlstring = await get_page(page_num)
-            root = ElementTree.fromstring(xmlstring)
-            error = root.findall('.//{http://api.namecheap.com/xml.response}Error')
-            if len(error) > 0:
-                raise Exception(error[0].text)
-            for d in root.findall('.//{http://api.namecheap.com/xml.response}Domain'):
-                dname = d.attrib['Name']
-                domains[dname] = d.attrib
-            total_items = int(root.findall('.//{http://api.namecheap.com/xml.response}TotalItems')[0].text)
+        # The first page tells us how many more there are, which can then be
+        # fetched at once (within the agent's rate limits) over one session
+        async with aiohttp.ClientSession() as session:
+            total_items = await self._fetch_domains_page(session, 1, page_size, domains)
             page_count = int((total_items - 1) / page_size) + 1
+            tasks = [
+                asyncio.ensure_future(self._fetch_domains_page(session, page_num, page_size, domains))
+                for page_num in range(2, page_count + 1)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop fetching the other pages before the session closes
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
 
         self.domains = domains
 
@@ -101,11 +151,12 @@ class Namecheap(RegistrarAgent):
         await self._save_state()
 
         # Ensure domain records are present for all domains listed in this file
-        await self._populate_domains()
+        counts = await self._populate_domains()
 
         # Return count of domains for confirmation message
         return {
-            "count": len(self.domains)
+            "count": len(self.domains),
+            **counts
         }
 
     async def get_registered_domains(self):
@@ -135,14 +186,12 @@ class Namecheap(RegistrarAgent):
         sld = parts[0]
         tld = ".".join(parts[1:])
 
-        async with aiohttp.ClientSession() as session:
-            url = self._get_url_prefix()
-            url = f"{url}&Command=namecheap.domains.dns.setCustom&SLD={sld}&TLD={tld}&Nameservers={dnshosts}"
-            async with session.get(url) as response:
-                if response.status != 200:
-                    _logger.error(f"Unexpected response from Namecheap API: {response.status}")
-                    return
-                xmlstring = await response.text()
+        url = self._get_url_prefix()
+        url = f"{url}&Command=namecheap.domains.dns.setCustom&SLD={sld}&TLD={tld}&Nameservers={dnshosts}"
+        status, xmlstring = await self._get(url)
+        if status != 200:
+            _logger.error(f"Unexpected response from Namecheap API: {status}")
+            return
 
         try:
             root = ElementTree.fromstring(xmlstring)
@@ -154,14 +203,12 @@ class Namecheap(RegistrarAgent):
     async def get_contacts(self, domain):
         _logger.info(f"Fetching domain registration contacts for {domain.name}.")
 
-        async with aiohttp.ClientSession() as session:
-            url = self._get_url_prefix()
-            url = f"{url}&Command=namecheap.domains.getContacts&DomainName={domain.name}"
-            async with session.get(url) as response:
-                if response.status != 200:
-                    _logger.error(f"Unexpected response from Namecheap API: {response.status}")
-                    return
-                xmlstring = await response.text()
+        url = self._get_url_prefix()
+        url = f"{url}&Command=namecheap.domains.getContacts&DomainName={domain.name}"
+        status, xmlstring = await self._get(url)
+        if status != 200:
+            _logger.error(f"Unexpected response from Namecheap API: {status}")
+            return
 
         try:
             root = ElementTree.fromstring(xmlstring)
@@ -176,62 +223,60 @@ class Namecheap(RegistrarAgent):
         from fixtures import NAMECHEAP_DOMAIN_CONTACTS as c
         from fixtures import NAMECHEAP_BILLING_CONTACT as b
 
-        async with aiohttp.ClientSession() as session:
-            url = self._get_url_prefix()
-            url = f"{url}&Command=namecheap.domains.setContacts&DomainName={domain.name}"
-            url = f"{url}&RegistrantOrganizationName={c.registrant.organisation}"
-            url = f"{url}&RegistrantFirstName={c.registrant.firstname}"
-            url = f"{url}&RegistrantLastName={c.registrant.lastname}"
-            url = f"{url}&RegistrantAddress1={c.registrant.address1}"
-            url = f"{url}&RegistrantAddress2={c.registrant.address2}"
-            url = f"{url}&RegistrantCity={c.registrant.city}"
-            url = f"{url}&RegistrantStateProvince={c.registrant.province}"
-            url = f"{url}&RegistrantPostalCode={c.registrant.postalcode}"
-            url = f"{url}&RegistrantCountry={c.registrant.country}"
-            url = f"{url}&RegistrantPhone={c.registrant.phone}"
-            url = f"{url}&RegistrantEmailAddress={c.registrant.email}"
-            url = f"{url}&TechOrganizationName={c.tech.organisation}"
-            url = f"{url}&TechFirstName={c.tech.firstname}"
-            url = f"{url}&TechLastName={c.tech.lastname}"
-            url = f"{url}&TechAddress1={c.tech.address1}"
-            url = f"{url}&TechAddress2={c.tech.address2}"
-            url = f"{url}&TechCity={c.tech.city}"
-            url = f"{url}&TechStateProvince={c.tech.province}"
-            url = f"{url}&TechPostalCode={c.tech.postalcode}"
-            url = f"{url}&TechCountry={c.tech.country}"
-            url = f"{url}&TechPhone={c.tech.phone}"
-            url = f"{url}&TechEmailAddress={c.tech.email}"
-            url = f"{url}&AdminOrganizationName={c.admin.organisation}"
-            url = f"{url}&AdminFirstName={c.admin.firstname}"
-            url = f"{url}&AdminLastName={c.admin.lastname}"
-            url = f"{url}&AdminAddress1={c.admin.address1}"
-            url = f"{url}&AdminAddress2={c.admin.address2}"
-            url = f"{url}&AdminCity={c.admin.city}"
-            url = f"{url}&AdminStateProvince={c.admin.province}"
-            url = f"{url}&AdminPostalCode={c.admin.postalcode}"
-            url = f"{url}&AdminCountry={c.admin.country}"
-            url = f"{url}&AdminPhone={c.admin.phone}"
-            url = f"{url}&AdminEmailAddress={c.admin.email}"
-            url = f"{url}&AuxBillingOrganizationName={b.organisation}"
-            url = f"{url}&AuxBillingFirstName={b.firstname}"
-            url = f"{url}&AuxBillingLastName={b.lastname}"
-            url = f"{url}&AuxBillingAddress1={b.address1}"
-            url = f"{url}&AuxBillingAddress2={b.address2}"
-            url = f"{url}&AuxBillingCity={b.city}"
-            url = f"{url}&AuxBillingStateProvince={b.province}"
-            url = f"{url}&AuxBillingPostalCode={b.postalcode}"
-            url = f"{url}&AuxBillingCountry={b.country}"
-            url = f"{url}&AuxBillingPhone={b.phone}"
-            url = f"{url}&AuxBillingEmailAddress={b.email}"
-
-            # See also 'extended attributes' for specific domains:
-            # https://www.namecheap.com/support/api/extended-attributes.aspx
-
-            async with session.get(url) as response:
-                if response.status != 200:
-                    _logger.error(f"Unexpected response from Namecheap API: {response.status}")
-                    return
-                xmlstring = await response.text()
+        url = self._get_url_prefix()
+        url = f"{url}&Command=namecheap.domains.setContacts&DomainName={domain.name}"
+        url = f"{url}&RegistrantOrganizationName={c.registrant.organisation}"
+        url = f"{url}&RegistrantFirstName={c.registrant.firstname}"
+        url = f"{url}&RegistrantLastName={c.registrant.lastname}"
+        url = f"{url}&RegistrantAddress1={c.registrant.address1}"
+        url = f"{url}&RegistrantAddress2={c.registrant.address2}"
+        url = f"{url}&RegistrantCity={c.registrant.city}"
+        url = f"{url}&RegistrantStateProvince={c.registrant.province}"
+        url = f"{url}&RegistrantPostalCode={c.registrant.postalcode}"
+        url = f"{url}&RegistrantCountry={c.registrant.country}"
+        url = f"{url}&RegistrantPhone={c.registrant.phone}"
+        url = f"{url}&RegistrantEmailAddress={c.registrant.email}"
+        url = f"{url}&TechOrganizationName={c.tech.organisation}"
+        url = f"{url}&TechFirstName={c.tech.firstname}"
+        url = f"{url}&TechLastName={c.tech.lastname}"
+        url = f"{url}&TechAddress1={c.tech.address1}"
+        url = f"{url}&TechAddress2={c.tech.address2}"
+        url = f"{url}&TechCity={c.tech.city}"
+        url = f"{url}&TechStateProvince={c.tech.province}"
+        url = f"{url}&TechPostalCode={c.tech.postalcode}"
+        url = f"{url}&TechCountry={c.tech.country}"
+        url = f"{url}&TechPhone={c.tech.phone}"
+        url = f"{url}&TechEmailAddress={c.tech.email}"
+        url = f"{url}&AdminOrganizationName={c.admin.organisation}"
+        url = f"{url}&AdminFirstName={c.admin.firstname}"
+        url = f"{url}&AdminLastName={c.admin.lastname}"
+        url = f"{url}&AdminAddress1={c.admin.address1}"
+        url = f"{url}&AdminAddress2={c.admin.address2}"
+        url = f"{url}&AdminCity={c.admin.city}"
+        url = f"{url}&AdminStateProvince={c.admin.province}"
+        url = f"{url}&AdminPostalCode={c.admin.postalcode}"
+        url = f"{url}&AdminCountry={c.admin.country}"
+        url = f"{url}&AdminPhone={c.admin.phone}"
+        url = f"{url}&AdminEmailAddress={c.admin.email}"
+        url = f"{url}&AuxBillingOrganizationName={b.organisation}"
+        url = f"{url}&AuxBillingFirstName={b.firstname}"
+        url = f"{url}&AuxBillingLastName={b.lastname}"
+        url = f"{url}&AuxBillingAddress1={b.address1}"
+        url = f"{url}&AuxBillingAddress2={b.address2}"
+        url = f"{url}&AuxBillingCity={b.city}"
+        url = f"{url}&AuxBillingStateProvince={b.province}"
+        url = f"{url}&AuxBillingPostalCode={b.postalcode}"
+        url = f"{url}&AuxBillingCountry={b.country}"
+        url = f"{url}&AuxBillingPhone={b.phone}"
+        url = f"{url}&AuxBillingEmailAddress={b.email}"
+
+        # See also 'extended attributes' for specific domains:
+        # https://www.namecheap.com/support/api/extended-attributes.aspx
+
+        status, xmlstring = await self._get(url)
+        if status != 200:
+            _logger.error(f"Unexpected response from Namecheap API: {status}")
+            return
 
         try:
             root = ElementTree.fromstring(xmlstring)
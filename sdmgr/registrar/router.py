@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, File
+from fastapi import APIRouter, Depends, File, UploadFile
 from starlette.responses import JSONResponse, Response
 from starlette.status import HTTP_201_CREATED
 import pymysql
 
 from sdmgr.oauth2 import *
 from sdmgr.db import *
+from sdmgr import settings
 from sdmgr.manager import m
+from sdmgr.jobs.router import refresh_in_worker, runs_in_worker, job_accepted
+from sdmgr.jobs.uploads import save_upload, UPLOAD_CHUNK_SIZE
+from sdmgr.registrar.streaming import iter_upload_chunks
 
 from pydantic import BaseModel
 
@@ -66,14 +70,24 @@ async def get_registrar(id: int, user = Depends(get_current_user)):
         pass
     return JSONResponse(r)
 
+async def import_in_worker(id, format, upload):
+    # The worker can't read the upload, so it's stored in the db a chunk at
+    # a time for the job to stream from
+    upload_id = await save_upload(iter_upload_chunks(upload, UPLOAD_CHUNK_SIZE))
+    job = await m.jobs.submit("import_registrar_file", {"agent_id": id, "format": format, "upload_id": upload_id},
+        f"Importing {format.upper()} file for registrar {id}")
+    return await job_accepted(job)
+
 @router.post("/registrars/{id:int}/csvfile", tags=["registrars"])
-async def update_registrar_by_csv_file(id: int, csvfile: bytes = File(...), user = Depends(get_current_user)):
+async def update_registrar_by_csv_file(id: int, csvfile: UploadFile = File(...), user = Depends(get_current_user)):
     """
     Upload fresh CSV file downloaded from registrar. Intended for use with the Marcaria module and any other modules for registrars that allow a CSV file of their domains to be downloaded.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return await import_in_worker(id, "csv", csvfile)
     agent = m.registrar_agents[id]
     try:
-        res = await agent.update_from_csvfile(csvfile)
+        res = await agent.update_from_csvfile(iter_upload_chunks(csvfile))
         return JSONResponse({
             "status":"ok",
             "records_read": res['count']
@@ -85,13 +99,15 @@ async def update_registrar_by_csv_file(id: int, csvfile: bytes = File(...), user
         }, status_code=500)
 
 @router.post("/registrars/{id:int}/jsonfile", tags=["registrars"])
-async def update_registrar_by_json_file(id: int, jsonfile: bytes = File(...), user = Depends(get_current_user)):
+async def update_registrar_by_json_file(id: int, jsonfile: UploadFile = File(...), user = Depends(get_current_user)):
     """
     Upload fresh JSON file downloaded from registrar. Intended for use with the IONOS module and any other modules for registrars that allow a JSON file of their domains to be downloaded.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return await import_in_worker(id, "json", jsonfile)
     agent = m.registrar_agents[id]
     try:
-        res = await agent.update_from_jsonfile(jsonfile)
+        res = await agent.update_from_jsonfile(iter_upload_chunks(jsonfile))
         return JSONResponse({
             "status":"ok",
             "records_read": res['count']
@@ -107,6 +123,8 @@ async def refresh_registrar_provider(id: int, user = Depends(get_current_user)):
     """
     Fetch a fresh copy of the information about the registrar for this agent. Used to force a fresh copy of the details to be fetched from the API.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return await refresh_in_worker("registrar", id)
     agent = m.registrar_agents[id]
     try:
         res = await agent.refresh()
@@ -125,6 +143,8 @@ async def get_registrar_status_for_domain(id: int, domainname, user = Depends(ge
     """
     Fetch the status of a domain from the registrar. Used to show the current status and expiry date of a given domain with the registrar. This can fetch the data directly from the registrar's API, or use cached data from a recent CSV download, depending on the registrar's capabilities.
     """
+    if not settings.MANAGER_IN_PROCESS:
+        return runs_in_worker()
     agent = m.registrar_agents[id]
     status = await agent.get_status_for_domain(domainname)
     return JSONResponse({
@@ -0,0 +1,209 @@
+import codecs
+import csv
+import json
+import re
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+# Helpers for importing large registrar exports a chunk at a time, rather
+# than reading, decoding and splitting the whole upload in memory.
+
+LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+# What may yet follow the part of a number read so far
+NUMBER_REST = re.compile(r"[0-9.eE+-]+")
+
+
+async def iter_upload_chunks(upload, chunk_size = 65536):
+    """
+    Yield the contents of an uploaded file (i.e. a starlette UploadFile) in
+    chunks of bytes.
+    """
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def iter_bytes(content):
+    """
+    Yield content already read into memory as a single chunk, so it can be
+    passed where a stream of chunks is expected.
+    """
+    yield content
+
+
+async def iter_text(chunks, encoding = "utf-8-sig"):
+    """
+    Decode a stream of byte chunks incrementally (so multi-byte characters
+    split across chunks, and any BOM, are handled).
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors = "replace")
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final = True)
+    if text:
+        yield text
+
+
+async def iter_lines(chunks, encoding = "utf-8-sig"):
+    """
+    Yield the lines of a stream of byte chunks, whether they end with
+    '\\r\\n', '\\r' or '\\n'.
+    """
+    buffer = ""
+    after_cr = False
+    async for text in iter_text(chunks, encoding):
+        # A '\r' ending the last chunk may be the first half of a '\r\n'
+        if after_cr and text.startswith("\n"):
+            text = text[1:]
+        after_cr = text.endswith("\r")
+        buffer += text
+        lines = LINE_BREAK.split(buffer)
+        buffer = lines.pop()
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def iter_csv_rows(chunks, encoding = "utf-8-sig"):
+    """
+    Yield the rows of a CSV file from a stream of byte chunks, skipping
+    blank lines. A quoted field may run over several lines (which are
+    joined with '\n').
+    """
+    record = None
+    async for line in iter_lines(chunks, encoding):
+        if record is None:
+            if line.strip() == "":
+                continue
+            record = line
+        else:
+            record += "\n" + line
+        # An odd number of quotes (escaped quotes come in pairs) means a
+        # quoted field is still open, so the record carries on
+        if record.count('"') % 2 == 1:
+            continue
+        yield next(csv.reader([record]))
+        record = None
+    if record is not None:
+        yield next(csv.reader([record]))
+
+
+async def iter_json_array_items(chunks, key, encoding = "utf-8-sig"):
+    """
+    Yield the items of the array under 'key' in a JSON object (i.e. the
+    entries of '{"domainList": [...]}') from a stream of byte chunks, each
+    parsed as soon as it has been read. Only one item is held in memory at
+    a time, rather than the whole document.
+    """
+    decoder = json.JSONDecoder()
+    texts = iter_text(chunks, encoding).__aiter__()
+    buffer = ""
+    pos = 0
+
+    async def read_more():
+        nonlocal buffer, pos
+        try:
+            text = await texts.__anext__()
+        except StopAsyncIteration:
+            return False
+        buffer = buffer[pos:] + text
+        pos = 0
+        return True
+
+    # Scan the top level object for the key, followed by the opening '['
+    depth = 0
+    in_string = False
+    escaped = False
+    string = None
+    last_string = None
+    current_key = None
+    found = False
+    while not found:
+        if pos >= len(buffer) and not await read_more():
+            raise ValueError(f"No '{key}' array found in JSON")
+        ch = buffer[pos]
+        pos += 1
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                if depth == 1:
+                    last_string = json.loads(f'"{string}"')
+                continue
+            if depth == 1:
+                string += ch
+        elif ch == '"':
+            in_string = True
+            string = ""
+            current_key = None
+        elif ch == ":" and depth == 1:
+            current_key = last_string
+            last_string = None
+        elif ch == "[" and depth == 1 and current_key == key:
+            found = True
+        elif ch in "{[":
+            depth += 1
+            current_key = None
+        elif ch in "}]":
+            depth -= 1
+        elif ch == ",":
+            current_key = None
+            last_string = None
+
+    # Then decode each item of the array in turn, reading more of the
+    # stream whenever an item is incomplete
+    while True:
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ","):
+            pos += 1
+        if pos >= len(buffer):
+            if not await read_more():
+                raise ValueError(f"Unexpected end of JSON in '{key}' array")
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if not await read_more():
+                raise
+            continue
+
+        # A number cut off at the end of what has been read so far (i.e.
+        # '12' of '12345', or '1' of '1.5') decodes fine, so an item is only
+        # taken once what follows it has been read
+        following = end
+        while following < len(buffer) and buffer[following].isspace():
+            following += 1
+        if following >= len(buffer) or NUMBER_REST.fullmatch(buffer, end):
+            if not await read_more():
+                raise ValueError(f"Unexpected end of JSON in '{key}' array")
+            continue
+        if buffer[following] not in ",]":
+            raise ValueError(f"Unexpected '{buffer[following]}' after item in '{key}' array")
+        yield item
+        pos = end
+
+
+async def iter_batches(items, batch_size):
+    """
+    Group the items of an async iterator into lists of up to 'batch_size'.
+    """
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
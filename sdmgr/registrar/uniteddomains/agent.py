@@ -1,9 +1,9 @@
 from ..base import RegistrarAgent
+from ..streaming import iter_bytes, iter_json_array_items
 
 import logging
 _logger = logging.getLogger(__name__)
 
-import json
 import orm
 
 
@@ -36,31 +36,29 @@ class UnitedDomains(RegistrarAgent):
         return "jsonfile"
 
     async def update_from_jsonfile(self, content):
+        """
+        Update from a JSON export, given as bytes or an async stream of byte
+        chunks. Entries of its 'domainList' are parsed as they are read, and
+        the domains synced to the db in batches.
+        """
         _logger.debug(f"Updating UnitedDomains data from JSON file.")
-
-        jsonfile = content.decode("utf8")
-        data = json.loads(jsonfile)
-
-        self.domains = {}
-        for d in data['domainList']:
-            self.domains[d['name']] = {
-                'name': d['name'],
-                'status': d['status'],
-                'expiry_date': d['expiry_date'],
-            }
-
+        if isinstance(content, bytes):
+            content = iter_bytes(content)
+
+        async def entries():
+            async for d in iter_json_array_items(content, "domainList"):
+                yield {
+                    'name': d['name'],
+                    'status': d['status'],
+                    'expiry_date': d['expiry_date'],
+                }
+
+        # Ensure domain records are present for all registered domains
+        result = await self._import_domains(entries(), "Registered")
         _logger.info(f"Updated UnitedDomains registrar with {len(self.domains)} domains from JSON file.")
 
-        # Record this in the 'state' field in the db
-        await self._save_state()
-
-        # Ensure domain records are present for all domains listed in this file
-        await self._populate_domains()
-
         # Return count of domains for confirmation message
-        return {
-            "count": len(self.domains)
-        }
+        return result
 
     async def get_status(self):
         active_domains = (x['name'] for x in self.domains.values() if x['status'] == "ACTIVE")
@@ -0,0 +1,154 @@
+from sdmgr import settings
+
+import aiodns
+import asyncio
+import itertools
+import time
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+# Failures that are answers in their own right, and worth caching for a while
+NEGATIVE_ERRORS = (
+    aiodns.error.ARES_ENOTFOUND,
+    aiodns.error.ARES_ENODATA,
+    aiodns.error.ARES_ESERVFAIL,
+)
+
+
+def _record_value(record):
+    if hasattr(record, 'host'):
+        return record.host
+    text = record.text
+    if isinstance(text, bytes):
+        text = text.decode("utf8", errors="replace")
+    return text
+
+
+class CachingResolver:
+    """
+    A small pool of aiodns resolvers shared by all DNS lookups, with an
+    in-process cache of answers that keeps each answer for its TTL. Lookups
+    that fail with NXDOMAIN, no data or SERVFAIL are cached for a short
+    while too, and concurrent lookups of the same name are combined.
+    """
+
+    def __init__(self, nameservers, pool_size, timeout, tries, negative_ttl, max_ttl, max_entries):
+        self.nameservers = list(nameservers)
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.tries = tries
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.channels = None
+        self.cache = {}
+        self.in_flight = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.combined = 0
+
+    def _channel(self):
+        # Created on first use, as aiodns binds to the running event loop
+        if self.channels is None:
+            self.channels = [aiodns.DNSResolver(
+                nameservers = self.nameservers or None,
+                timeout = self.timeout,
+                tries = self.tries
+            ) for i in range(self.pool_size)]
+            self._next_channel = itertools.cycle(self.channels)
+        return next(self._next_channel)
+
+    async def query(self, name, type, min_ttl = 0):
+        """
+        Look up the records of the given type for a name, returning their
+        values (i.e. hostnames, addresses or TXT strings). Raises an
+        aiodns.error.DNSError if the lookup fails. Answers are cached for at
+        least 'min_ttl' seconds, if given.
+        """
+        key = (name.lower().rstrip("."), type.upper())
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            expires, values, error = entry
+            if error is not None:
+                self.negative_hits += 1
+                raise error
+            self.hits += 1
+            return list(values)
+
+        if key in self.in_flight:
+            self.combined += 1
+            return list(await asyncio.shield(self.in_flight[key]))
+
+        self.misses += 1
+        lookup = asyncio.ensure_future(self._lookup(key, min_ttl))
+        self.in_flight[key] = lookup
+        try:
+            return list(await asyncio.shield(lookup))
+        finally:
+            if lookup.done():
+                self.in_flight.pop(key, None)
+
+    def forget(self, name, type):
+        """
+        Drop any cached answer for the name and type, i.e. after changing
+        its records.
+        """
+        self.cache.pop((name.lower().rstrip("."), type.upper()), None)
+
+    async def _lookup(self, key, min_ttl):
+        name, type = key
+        try:
+            records = await self._channel().query(name, type)
+        except aiodns.error.DNSError as e:
+            if len(e.args) > 0 and e.args[0] in NEGATIVE_ERRORS:
+                self._store(key, self.negative_ttl, None, e)
+            raise
+        finally:
+            self.in_flight.pop(key, None)
+
+        values = [_record_value(r) for r in records]
+        ttls = [r.ttl for r in records if getattr(r, 'ttl', None) is not None]
+        ttl = min(ttls) if len(ttls) > 0 else 0
+        self._store(key, max(min(ttl, self.max_ttl), min_ttl), values, None)
+        return values
+
+    def _store(self, key, ttl, values, error):
+        if ttl <= 0:
+            return
+        if len(self.cache) >= self.max_entries:
+            self._evict()
+        self.cache[key] = (time.monotonic() + ttl, values, error)
+
+    def _evict(self):
+        # Drop expired answers, then the oldest ones if still too many
+        now = time.monotonic()
+        for key in [k for k, entry in self.cache.items() if entry[0] <= now]:
+            del self.cache[key]
+        for key in list(itertools.islice(self.cache.keys(), max(0, len(self.cache) - self.max_entries + 1))):
+            del self.cache[key]
+
+    def metrics(self):
+        lookups = self.hits + self.negative_hits + self.misses + self.combined
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "combined": self.combined,
+            "entries": len(self.cache),
+            "hit_rate": (self.hits + self.negative_hits + self.combined) / lookups if lookups > 0 else 0,
+        }
+
+
+# Singleton shared by all checks
+resolver = CachingResolver(
+    nameservers = settings.DNS_RESOLVERS,
+    pool_size = settings.DNS_RESOLVER_POOL_SIZE,
+    timeout = settings.DNS_TIMEOUT,
+    tries = settings.DNS_TRIES,
+    negative_ttl = settings.DNS_NEGATIVE_TTL,
+    max_ttl = settings.DNS_MAX_TTL,
+    max_entries = settings.DNS_CACHE_SIZE,
+)
@@ -0,0 +1,132 @@
+from sdmgr.db import database, Domain
+
+import heapq
+import math
+import random
+import datetime
+import sqlalchemy
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class CheckScheduler:
+    """
+    Keeps a heap of active domains ordered by the time they are next due to
+    be checked. The most overdue domains are handed out first, and domains
+    are rescheduled with some jitter so that checks stay spread evenly
+    across the check interval rather than all falling due at once.
+    """
+
+    def __init__(self, interval, jitter = 0.1):
+        self.interval = interval
+        self.jitter = jitter
+        self.heap = []
+        self.due_at = {}
+        self.loaded_time = None
+
+    def needs_reload(self, now):
+        if self.loaded_time is None:
+            return True
+        return (now - self.loaded_time).total_seconds() >= self.interval
+
+    async def load(self, owns = None):
+        """
+        Rebuild the heap from the persisted 'next_check_at' times of the
+        active domains, limited to those accepted by 'owns' if given.
+        Domains that have never been scheduled are spread evenly across the
+        next interval.
+        """
+        now = datetime.datetime.now()
+        domains = await Domain.objects.filter(active=True).all()
+        if owns is not None:
+            domains = [domain for domain in domains if owns(domain.id)]
+
+        self.heap = []
+        self.due_at = {}
+        unscheduled = []
+        for domain in domains:
+            if domain.next_check_at is None:
+                unscheduled.append(domain.id)
+            else:
+                self.schedule(domain.id, domain.next_check_at)
+        for i, domain_id in enumerate(unscheduled):
+            offset = self.interval * i / len(unscheduled)
+            self.schedule(domain_id, now + datetime.timedelta(seconds = offset))
+
+        self.loaded_time = now
+        _logger.info(f"Scheduled {len(self.due_at)} active domains for checks ({len(unscheduled)} newly scheduled).")
+
+    async def pick_up_resets(self, now, owns = None):
+        """
+        Bring forward any scheduled domains whose persisted 'next_check_at'
+        has been moved earlier by another process (i.e. an API process
+        resetting a domain's check interval after its settings changed).
+        Domains being checked aren't in the heap, so are left alone.
+        """
+        table = Domain.__table__
+        query = sqlalchemy.select([table.c.id, table.c.next_check_at]).where(sqlalchemy.and_(
+            table.c.active == True,
+            table.c.next_check_at <= now
+        ))
+        count = 0
+        for row in await database.fetch_all(query):
+            domain_id, when = row[0], row[1]
+            if owns is not None and not owns(domain_id):
+                continue
+            due_at = self.due_at.get(domain_id)
+            if due_at is not None and when < due_at:
+                self.schedule(domain_id, when)
+                count += 1
+        if count > 0:
+            _logger.info(f"Brought forward checks for {count} domains.")
+        return count
+
+    def schedule(self, domain_id, when):
+        # Older heap entries for the domain are left in place, and skipped
+        # when popped as they no longer match 'due_at'.
+        self.due_at[domain_id] = when
+        heapq.heappush(self.heap, (when, domain_id))
+
+    def unschedule(self, domain_id):
+        self.due_at.pop(domain_id, None)
+
+    def pop_due(self, now, limit = None):
+        """
+        Remove and return the ids of the domains due to be checked by 'now',
+        most overdue first.
+        """
+        domain_ids = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            if limit is not None and len(domain_ids) >= limit:
+                break
+            when, domain_id = heapq.heappop(self.heap)
+            if self.due_at.get(domain_id) != when:
+                continue
+            del self.due_at[domain_id]
+            domain_ids.append(domain_id)
+        return domain_ids
+
+    def pass_limit(self, tick):
+        """
+        The most domains to hand out in one tick. This is twice the even
+        share of the portfolio per tick, so a backlog of overdue domains
+        (i.e. after downtime) drains steadily rather than in one burst.
+        """
+        share = len(self.due_at) * tick / max(1, self.interval)
+        return max(1, math.ceil(share * 2))
+
+    def next_check_time(self, now, interval = None):
+        if interval is None:
+            interval = self.interval
+        spread = interval * self.jitter
+        return now + datetime.timedelta(seconds = interval + random.uniform(-spread, spread))
+
+    def metrics(self):
+        now = datetime.datetime.now()
+        overdue = [when for when in self.due_at.values() if when <= now]
+        return {
+            "scheduled": len(self.due_at),
+            "overdue": len(overdue),
+            "max_overdue_seconds": (now - min(overdue)).total_seconds() if len(overdue) > 0 else 0,
+        }
@@ -1,5 +1,5 @@
 from starlette.config import Config
-from starlette.datastructures import URL, Secret
+from starlette.datastructures import URL, Secret, CommaSeparatedStrings
 
 config = Config(".env")
 
@@ -25,3 +25,118 @@ agents_to_import = [
     "sdmgr.notifiers.discord",
     "sdmgr.notifiers.smtp",
 ]
+
+# How often (in seconds) the manager checks each active domain (0 disables)
+MANAGER_LOOP_SECS = config('MANAGER_LOOP_SECS', cast=int, default=0)
+
+# Bounds (in seconds) on how often each domain is checked. A domain's check
+# interval grows by MANAGER_CHECK_BACKOFF each time its checks pass, and drops
+# back to the minimum when a check fails or the domain is edited
+MANAGER_CHECK_INTERVAL_MIN = config('MANAGER_CHECK_INTERVAL_MIN', cast=int, default=MANAGER_LOOP_SECS)
+MANAGER_CHECK_INTERVAL_MAX = config('MANAGER_CHECK_INTERVAL_MAX', cast=int, default=MANAGER_LOOP_SECS * 16)
+MANAGER_CHECK_BACKOFF = config('MANAGER_CHECK_BACKOFF', cast=float, default=2.0)
+
+# How often (in seconds) the manager looks for domains due to be checked
+MANAGER_TICK_SECS = config('MANAGER_TICK_SECS', cast=int, default=30)
+
+# Fraction of the check interval by which to randomly vary each domain's
+# next check, to keep checks spread evenly
+MANAGER_CHECK_JITTER = config('MANAGER_CHECK_JITTER', cast=float, default=0.1)
+
+# Number of domain checks the manager will run concurrently
+MANAGER_WORKERS = config('MANAGER_WORKERS', cast=int, default=10)
+
+# Number of recent passes of the manager loop to keep for reporting
+MANAGER_PASS_HISTORY = config('MANAGER_PASS_HISTORY', cast=int, default=20)
+
+# Number of background jobs (i.e. checks requested via the API) to run at once
+JOB_WORKERS = config('JOB_WORKERS', cast=int, default=4)
+
+# Number of times to attempt an interrupted background job before giving up
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', cast=int, default=3)
+
+# How often (in seconds) a process running jobs looks for newly submitted ones
+JOB_POLL_SECS = config('JOB_POLL_SECS', cast=int, default=2)
+
+# How long (in seconds) finished background jobs are kept before being deleted
+JOB_RETENTION_SECS = config('JOB_RETENTION_SECS', cast=int, default=7 * 86400)
+
+# Modules to import (and register) job handlers from
+jobs_to_import = [
+    "sdmgr.domains.jobs",
+    "sdmgr.jobs.agents",
+]
+
+# Whether the API process also runs the manager (agents, monitoring loop and
+# background jobs). Set to false when running 'sdmgr-worker' separately, so
+# that several API processes can be run without duplicating that work.
+MANAGER_IN_PROCESS = config('MANAGER_IN_PROCESS', cast=bool, default=True)
+
+# Number of shards the domains are split into between manager replicas, each
+# replica leasing its share of them (0 disables leasing, so every replica
+# checks every domain)
+MANAGER_SHARDS = config('MANAGER_SHARDS', cast=int, default=16)
+
+# How long (in seconds) a replica's shard leases last without being renewed
+MANAGER_LEASE_SECS = config('MANAGER_LEASE_SECS', cast=int, default=60)
+
+# Resolvers used for DNS checks (comma separated, default is the system's)
+DNS_RESOLVERS = config('DNS_RESOLVERS', cast=CommaSeparatedStrings, default="")
+DNS_RESOLVER_POOL_SIZE = config('DNS_RESOLVER_POOL_SIZE', cast=int, default=4)
+DNS_TIMEOUT = config('DNS_TIMEOUT', cast=float, default=5.0)
+DNS_TRIES = config('DNS_TRIES', cast=int, default=2)
+
+# How long (in seconds) DNS answers are cached. Answers are kept for their
+# TTL, up to DNS_MAX_TTL. NXDOMAIN/SERVFAIL answers are kept for
+# DNS_NEGATIVE_TTL.
+DNS_MAX_TTL = config('DNS_MAX_TTL', cast=int, default=3600)
+DNS_NEGATIVE_TTL = config('DNS_NEGATIVE_TTL', cast=int, default=60)
+DNS_CACHE_SIZE = config('DNS_CACHE_SIZE', cast=int, default=100000)
+
+# How long (in seconds) nameserver addresses are cached, at least
+DNS_NAMESERVER_CACHE_SECS = config('DNS_NAMESERVER_CACHE_SECS', cast=int, default=86400)
+
+# Lookups sent per second (0 for no limit), and kept in flight per resolver
+# channel, when sweeping the DNS records of the domains due for checks
+DNS_PROBE_QPS = config('DNS_PROBE_QPS', cast=int, default=500)
+DNS_PROBE_CONCURRENCY = config('DNS_PROBE_CONCURRENCY', cast=int, default=50)
+
+# How long (in seconds) the results of a sweep are used by checks, before
+# falling back to live lookups
+DNS_PROBE_MAX_AGE = config('DNS_PROBE_MAX_AGE', cast=int, default=MANAGER_TICK_SECS * 2)
+
+# How the NS check finds the nameservers a domain is delegated to: either
+# "recursive" (ask the resolvers) or "authoritative" (ask the parent zone's
+# servers directly, so the answer isn't up to a TTL out of date)
+DNS_NS_CHECK_MODE = config('DNS_NS_CHECK_MODE', default="recursive")
+
+# How long (in seconds) the addresses of parent zone (i.e. TLD) servers are
+# cached
+DNS_PARENT_CACHE_SECS = config('DNS_PARENT_CACHE_SECS', cast=int, default=86400)
+
+# Most Route53 API calls in progress at once, per DNS agent
+ROUTE53_MAX_IN_FLIGHT = config('ROUTE53_MAX_IN_FLIGHT', cast=int, default=4)
+
+# How long (in seconds) Route53 record changes are collected for, before
+# being sent together as one change per zone
+ROUTE53_FLUSH_SECS = config('ROUTE53_FLUSH_SECS', cast=float, default=1.0)
+
+# How long (in seconds) to wait before first polling the status of a Route53
+# change, doubling for each poll up to ROUTE53_POLL_MAX_SECS
+ROUTE53_POLL_SECS = config('ROUTE53_POLL_SECS', cast=float, default=2.0)
+ROUTE53_POLL_MAX_SECS = config('ROUTE53_POLL_MAX_SECS', cast=float, default=30.0)
+
+# How long (in seconds) snapshots of Route53 zones' record sets are used,
+# before being fetched again
+ROUTE53_SNAPSHOT_SECS = config('ROUTE53_SNAPSHOT_SECS', cast=int, default=3600)
+
+# Most Route53 zones being created at once, when creating zones in bulk
+ROUTE53_MAX_ZONE_CREATES = config('ROUTE53_MAX_ZONE_CREATES', cast=int, default=5)
+
+# Id of the registrar assumed for new domains found on a DNS provider,
+# unless set in the agent's 'default_registrar' setting
+DNS_DEFAULT_REGISTRAR = config('DNS_DEFAULT_REGISTRAR', cast=int, default=3)
+
+# Number of domains synced to the db at a time when importing a registrar's
+# export file
+IMPORT_BATCH_SIZE = config('IMPORT_BATCH_SIZE', cast=int, default=1000)
@@ -3,7 +3,9 @@ from starlette.responses import JSONResponse, Response
 
 from sdmgr.oauth2 import *
 from sdmgr.db import *
+from sdmgr import settings
 from sdmgr.manager import m
+from sdmgr.jobs.router import job_accepted
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -51,6 +53,10 @@ async def check_site_ssl(id: int, user = Depends(get_current_user)):
     """
     site = await Site.objects.get(id = id)
     _logger.info(f"User '{user.username}' checking SSL for site '{site.label}'.")
+    if not settings.MANAGER_IN_PROCESS:
+        job = await m.jobs.submit("check_site_ssl", {"site_id": id}, f"Checking SSL for site '{site.label}'",
+            idempotency_key = f"check_site_ssl:{id}")
+        return await job_accepted(job)
     status = await m.check_site_ssl_certs(site)
 
     return JSONResponse({
@@ -0,0 +1,71 @@
+from sdmgr import manager
+from sdmgr.db import database
+from sdmgr.agent import load_and_register_agents
+
+import signal
+import asyncio
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+m: manager.Manager = manager.m
+
+
+# Runs the manager (agents, monitoring loop and background jobs) without the
+# API, so the API can be run with as many processes as needed and only
+# submit work via the 'jobs' table. Run with MANAGER_IN_PROCESS=false set on
+# the API processes.
+
+async def startup():
+    _logger.debug("Loading modules...")
+    await load_and_register_agents()
+
+    _logger.debug("Connecting to database...")
+    await database.connect()
+
+    _logger.debug("Running manager...")
+    await m.run()
+
+async def shutdown(sig):
+    _logger.info(f"Received signal: {sig}")
+
+    _logger.info("Releasing shard leases...")
+    try:
+        await m.leases.release_all()
+    except Exception as e:
+        _logger.exception(e)
+
+    _logger.info("Cancelling remaining tasks...")
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    _logger.info("Disconnecting from database...")
+    await database.disconnect()
+
+    _logger.info("Stopping main loop...")
+    asyncio.get_event_loop().stop()
+
+def handle_exception(loop, context):
+    msg = context.get("exception", context["message"])
+    _logger.error(f"Caught exception in worker: {msg}")
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    loop = asyncio.get_event_loop()
+    for s in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            s, lambda s=s: asyncio.create_task(shutdown(s)))
+    loop.set_exception_handler(handle_exception)
+
+    try:
+        loop.run_until_complete(startup())
+        loop.run_forever()
+    finally:
+        loop.close()
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,7 @@ setup(name = 'site-domain-manager',
         'sdmgr.waf',
         'sdmgr.waf.k8s',
         'sdmgr.domains',
+        'sdmgr.jobs',
         'sdmgr.notifiers',
         'sdmgr.notifiers.discord',
         'sdmgr.notifiers.smtp',
@@ -48,6 +49,7 @@ setup(name = 'site-domain-manager',
     ],
     entry_points = {
         'console_scripts': [
-            'sdmgr = sdmgr.app:main'
+            'sdmgr = sdmgr.app:main',
+            'sdmgr-worker = sdmgr.worker:main',
         ]
     })
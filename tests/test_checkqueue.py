@@ -0,0 +1,59 @@
+import pytest
+
+import asyncio
+
+from sdmgr.checkqueue import CheckQueue
+
+
+@pytest.mark.asyncio
+async def test_check_queue_bounds_concurrency():
+    running = 0
+    peak = 0
+
+    async def handler(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return item * 2
+
+    queue = CheckQueue(handler, 3)
+    futures = [queue.put(i, i) for i in range(10)]
+    results = await asyncio.gather(*futures)
+    await queue.stop()
+
+    assert results == [i * 2 for i in range(10)]
+    assert peak == 3
+    assert queue.metrics()['processed'] == 10
+
+@pytest.mark.asyncio
+async def test_check_queue_merges_duplicate_keys():
+    calls = []
+
+    async def handler(item):
+        calls.append(item)
+        await asyncio.sleep(0.01)
+        return item
+
+    queue = CheckQueue(handler, 2)
+    first = queue.put("example.com", "example.com")
+    second = queue.put("example.com", "example.com")
+    assert first is second
+    await queue.join()
+    await queue.stop()
+
+    assert calls == ["example.com"]
+
+@pytest.mark.asyncio
+async def test_check_queue_reports_failures():
+    async def handler(item):
+        raise Exception("boom")
+
+    queue = CheckQueue(handler, 1)
+    future = queue.put(1, 1)
+    with pytest.raises(Exception):
+        await future
+    await queue.stop()
+
+    assert queue.metrics()['failed'] == 1
@@ -0,0 +1,59 @@
+import pytest
+
+import asyncio
+import struct
+
+from sdmgr.delegation import DelegationChecker, build_query, TYPE_NS, CLASS_IN
+
+
+def encode_name(name):
+    return b"".join(bytes([len(x)]) + x.encode() for x in name.split(".")) + b"\x00"
+
+class StubParentServer(asyncio.DatagramProtocol):
+    """
+    Answers every NS query with a referral to two nameservers, as a TLD's
+    servers would, using a compression pointer to the question name.
+    """
+
+    def __init__(self, nameservers):
+        self.nameservers = nameservers
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries += 1
+        query_id = struct.unpack("!H", data[:2])[0]
+        question = data[12:]
+        header = struct.pack("!HHHHHH", query_id, 0x8000, 1, 0, len(self.nameservers), 0)
+        authority = b""
+        for ns in self.nameservers:
+            rdata = encode_name(ns)
+            authority += b"\xc0\x0c" + struct.pack("!HHIH", TYPE_NS, CLASS_IN, 172800, len(rdata)) + rdata
+        self.transport.sendto(header + question + authority, addr)
+
+class StubResolver:
+    async def query(self, name, type):
+        return ["a.nic.example"] if type == 'NS' else ["127.0.0.1"]
+
+
+@pytest.mark.asyncio
+async def test_delegation_read_from_parent_referral():
+    loop = asyncio.get_event_loop()
+    server = StubParentServer(["ns-1.awsdns-01.org", "ns-2.awsdns-02.com"])
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=("127.0.0.1", 0))
+    port = transport.get_extra_info("sockname")[1]
+
+    try:
+        checker = DelegationChecker(StubResolver(), 3600, 1.0, port=port)
+        ns = await checker.get_delegation("Example.com.")
+        assert ns == {"ns-1.awsdns-01.org", "ns-2.awsdns-02.com"}
+        assert checker.parent_servers["com"][1] == ["127.0.0.1"]
+        assert server.queries == 1
+    finally:
+        transport.close()
+
+def test_query_encodes_non_ascii_labels():
+    query = build_query(1, "bücher.example.")
+    assert query[12:] == b"\x0dxn--bcher-kva\x07example\x00" + struct.pack("!HH", TYPE_NS, CLASS_IN)
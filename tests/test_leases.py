@@ -0,0 +1,77 @@
+import pytest
+
+import datetime
+
+from sdmgr.db import database, ManagerLease, ManagerReplica
+from sdmgr.leases import ShardLeases
+
+
+# Runs against whichever database DATABASE_URL points to (i.e. MySQL, or
+# 'sqlite:///test.db' for a quick local run).
+
+async def reset_leases():
+    await database.execute(ManagerLease.__table__.delete())
+    await database.execute(ManagerReplica.__table__.delete())
+
+@pytest.mark.asyncio
+async def test_replicas_split_shards():
+    await database.connect()
+    try:
+        await reset_leases()
+        a = ShardLeases("replica-a", 8, 60)
+        b = ShardLeases("replica-b", 8, 60)
+
+        await a.renew()
+        assert len(a.owned) == 8
+
+        # Second replica joins, first gives up its excess on next renewal
+        await b.renew()
+        await a.renew()
+        await b.renew()
+        assert a.owned.isdisjoint(b.owned)
+        assert len(a.owned) == 4 and len(b.owned) == 4
+        assert all(a.owns(id) != b.owns(id) for id in range(1, 100))
+    finally:
+        await reset_leases()
+        await database.disconnect()
+
+@pytest.mark.asyncio
+async def test_expired_shards_are_taken_over():
+    await database.connect()
+    try:
+        await reset_leases()
+        a = ShardLeases("replica-a", 4, 60)
+        b = ShardLeases("replica-b", 4, 60)
+        await a.renew()
+        await b.renew()
+        assert len(b.owned) == 0
+
+        # Replica 'a' stops renewing, and its heartbeat and leases run out
+        expired = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        for table in (ManagerLease.__table__, ManagerReplica.__table__):
+            await database.execute(table.update().where(table.c.owner == "replica-a").values(expires = expired))
+
+        await b.renew()
+        assert len(b.owned) == 4
+        assert b.live_owners == set(["replica-b"])
+    finally:
+        await reset_leases()
+        await database.disconnect()
+
+@pytest.mark.asyncio
+async def test_heartbeat_without_shards():
+    await database.connect()
+    try:
+        await reset_leases()
+        a = ShardLeases("replica-a", 0, 60)
+        b = ShardLeases("replica-b", 0, 60)
+        await a.renew()
+        await b.renew()
+        assert b.live_owners == set(["replica-a", "replica-b"])
+
+        await a.release_all()
+        await b.renew()
+        assert b.live_owners == set(["replica-b"])
+    finally:
+        await reset_leases()
+        await database.disconnect()
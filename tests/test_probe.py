@@ -0,0 +1,47 @@
+import pytest
+
+import asyncio
+import aiodns
+
+from sdmgr.probe import DNSProbe
+
+
+class FakeDomain:
+    def __init__(self, name, update_a_records = ""):
+        self.name = name
+        self.update_a_records = update_a_records
+
+class FakeResolver:
+    pool_size = 2
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def query(self, hostname, type):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if type == 'AAAA':
+            raise aiodns.error.DNSError(aiodns.error.ARES_ENODATA, "No data")
+        if type == 'TXT':
+            raise aiodns.error.DNSError(aiodns.error.ARES_ETIMEOUT, "Timeout")
+        return [f"{type}:{hostname}"]
+
+
+@pytest.mark.asyncio
+async def test_probe_sweeps_domains_into_snapshot():
+    resolver = FakeResolver()
+    probe = DNSProbe(resolver, 0, 2)
+    domains = [FakeDomain(f"example{i}.com", "www") for i in range(5)]
+
+    snapshot = await probe.sweep(domains)
+
+    assert snapshot.get("example1.com", "NS") == ["NS:example1.com"]
+    assert snapshot.get("WWW.example1.com.", "A") == ["A:www.example1.com"]
+    assert snapshot.get("example1.com", "AAAA") == []
+    assert snapshot.get("example1.com", "TXT") is None
+    assert resolver.peak == 4
+    assert probe.metrics()['lookups'] == 30
+    assert probe.metrics()['errors'] == 5
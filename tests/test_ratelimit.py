@@ -0,0 +1,73 @@
+import pytest
+
+import asyncio
+import time
+
+from sdmgr.ratelimit import AgentBudget, RateLimitedException, check_rate_limit
+
+
+@pytest.mark.asyncio
+async def test_budget_limits_rate():
+    budget = AgentBudget("test:1", rate = 50, burst = 5)
+
+    async def call():
+        return True
+
+    start = time.monotonic()
+    await asyncio.gather(*[budget.call(call) for i in range(15)])
+    elapsed = time.monotonic() - start
+
+    # 5 straight away, then 10 more at 50 a second
+    assert elapsed >= 0.18
+    assert budget.metrics()['calls'] == 15
+    assert budget.metrics()['wait_seconds'] > 0
+
+@pytest.mark.asyncio
+async def test_budget_can_start_empty():
+    budget = AgentBudget("test:3", rate = 50, burst = 5, full = False)
+
+    async def call():
+        return True
+
+    start = time.monotonic()
+    await asyncio.gather(*[budget.call(call) for i in range(5)])
+    elapsed = time.monotonic() - start
+
+    # No burst to begin with, so all 5 wait for the refill
+    assert elapsed >= 0.09
+
+@pytest.mark.asyncio
+async def test_budget_retries_rate_limited_calls():
+    budget = AgentBudget("test:2", concurrency = 1, max_retries = 2)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RateLimitedException(retry_after = 0.01)
+        return "ok"
+
+    assert await budget.call(call) == "ok"
+    metrics = budget.metrics()
+    assert metrics['rejections'] == 2
+    assert metrics['retries'] == 2
+
+    attempts.clear()
+    budget.max_retries = 1
+    with pytest.raises(RateLimitedException):
+        await budget.call(call)
+    assert budget.metrics()['failures'] == 1
+
+def test_http_429_is_rate_limited():
+    class Response:
+        def __init__(self, status, headers = {}):
+            self.status = status
+            self.headers = headers
+
+    check_rate_limit(Response(200), "Test")
+    with pytest.raises(RateLimitedException) as e:
+        check_rate_limit(Response(429, {"Retry-After": "3"}), "Test")
+    assert e.value.retry_after == 3.0
+    with pytest.raises(RateLimitedException) as e:
+        check_rate_limit(Response(429), "Test")
+    assert e.value.retry_after is None
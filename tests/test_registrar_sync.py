@@ -0,0 +1,75 @@
+import pytest
+
+import datetime
+
+from sdmgr.db import database, Domain, Registrar
+from sdmgr.registrar.base import RegistrarAgent
+
+
+# Runs against whichever database DATABASE_URL points to (i.e. MySQL, or
+# 'sqlite:///test.db' for a quick local run).
+
+class FakeManager:
+    registrar_agents = {}
+
+class FakeRegistrar(RegistrarAgent):
+    _label_ = "Fake"
+
+    def __init__(self, data, domainnames):
+        RegistrarAgent.__init__(self, data, FakeManager())
+        self.domainnames = domainnames
+
+    async def get_registered_domains(self):
+        return self.domainnames
+
+async def cleanup():
+    table = Domain.__table__
+    await database.execute(table.delete().where(table.c.name.like("sync-test-%")))
+    table = Registrar.__table__
+    await database.execute(table.delete().where(table.c.label.like("sync-test-%")))
+
+@pytest.mark.asyncio
+async def test_populate_domains_in_bulk():
+    await database.connect()
+    try:
+        await cleanup()
+        now = datetime.datetime.now()
+        old = await Registrar.objects.create(label="sync-test-old", agent_module="fake", state={}, updated_time=now)
+        new = await Registrar.objects.create(label="sync-test-new", agent_module="fake", state={}, updated_time=now)
+        await Domain.objects.create(name="sync-test-moved.com", registrar=old)
+        await Domain.objects.create(name="sync-test-same.com", registrar=new)
+
+        names = ["sync-test-moved.com", "sync-test-same.com"] + [f"sync-test-{i}.com" for i in range(3)]
+        counts = await FakeRegistrar(new, names)._populate_domains()
+
+        assert counts == {"created": 3, "moved": 1, "unchanged": 1}
+        created = await Domain.objects.get(name="sync-test-1.com")
+        assert created.registrar.id == new.id
+        assert created.update_a_records == "www"
+        assert created.active
+        moved = await Domain.objects.get(name="sync-test-moved.com")
+        assert moved.registrar.id == new.id
+    finally:
+        await cleanup()
+        await database.disconnect()
+
+@pytest.mark.asyncio
+async def test_failed_import_keeps_domains():
+    await database.connect()
+    try:
+        await cleanup()
+        now = datetime.datetime.now()
+        data = await Registrar.objects.create(label="sync-test-import", agent_module="fake", state={}, updated_time=now)
+        agent = FakeRegistrar(data, [])
+        agent.domains = {"sync-test-kept.com": {"name": "sync-test-kept.com", "status": "Registered"}}
+
+        async def entries():
+            yield {"name": "sync-test-new.com", "status": "Registered"}
+            raise ValueError("Truncated export")
+
+        with pytest.raises(ValueError):
+            await agent._import_domains(entries(), "Registered")
+        assert list(agent.domains.keys()) == ["sync-test-kept.com"]
+    finally:
+        await cleanup()
+        await database.disconnect()
@@ -0,0 +1,56 @@
+import pytest
+
+import asyncio
+import aiodns
+
+from sdmgr.resolver import CachingResolver
+
+
+class FakeRecord:
+    def __init__(self, host, ttl):
+        self.host = host
+        self.ttl = ttl
+
+class FakeChannel:
+    def __init__(self):
+        self.queries = []
+
+    async def query(self, name, type):
+        self.queries.append((name, type))
+        await asyncio.sleep(0.01)
+        if name == "missing.example.com":
+            raise aiodns.error.DNSError(aiodns.error.ARES_ENOTFOUND, "Domain name not found")
+        return [FakeRecord("192.0.2.1", 300)]
+
+def make_resolver(channel):
+    resolver = CachingResolver([], 1, 5.0, 1, negative_ttl=60, max_ttl=3600, max_entries=100)
+    resolver._channel = lambda: channel
+    return resolver
+
+
+@pytest.mark.asyncio
+async def test_resolver_caches_and_combines_lookups():
+    channel = FakeChannel()
+    resolver = make_resolver(channel)
+
+    results = await asyncio.gather(*[resolver.query("example.com", "A") for i in range(5)])
+    assert results == [["192.0.2.1"]] * 5
+    assert await resolver.query("EXAMPLE.com.", "A") == ["192.0.2.1"]
+
+    assert channel.queries == [("example.com", "A")]
+    metrics = resolver.metrics()
+    assert metrics['misses'] == 1
+    assert metrics['combined'] == 4
+    assert metrics['hits'] == 1
+
+@pytest.mark.asyncio
+async def test_resolver_caches_nxdomain():
+    channel = FakeChannel()
+    resolver = make_resolver(channel)
+
+    for i in range(2):
+        with pytest.raises(aiodns.error.DNSError):
+            await resolver.query("missing.example.com", "A")
+
+    assert len(channel.queries) == 1
+    assert resolver.metrics()['negative_hits'] == 1
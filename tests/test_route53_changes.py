@@ -0,0 +1,72 @@
+import pytest
+
+import asyncio
+
+from sdmgr.dns_provider.route53.changes import ZoneChangeBatcher
+from sdmgr.dns_provider.route53.records import ZoneRecordCache
+
+
+class FakeAgent:
+    label = "fake"
+
+    def __init__(self):
+        self.batches = []
+        self.records = ZoneRecordCache(self, 60)
+
+    async def _call(self, method, HostedZoneId, ChangeBatch = None, **kwargs):
+        if method == 'list_resource_record_sets':
+            return {
+                'ResourceRecordSets': [a_record("example.com.", "192.0.2.9")],
+                'IsTruncated': False,
+            }
+        self.batches.append((HostedZoneId, ChangeBatch['Changes']))
+        return {'ChangeInfo': {'Id': f"/change/{len(self.batches)}"}}
+
+def a_record(name, ip):
+    return {'Name': name, 'Type': 'A', 'TTL': 300, 'ResourceRecords': [{'Value': ip}]}
+
+
+@pytest.mark.asyncio
+async def test_changes_batched_per_zone():
+    agent = FakeAgent()
+    batcher = ZoneChangeBatcher(agent, 0.01)
+
+    change_ids = await asyncio.gather(
+        batcher.upsert("Z1", a_record("example.com", "192.0.2.1")),
+        batcher.upsert("Z1", a_record("www.example.com", "192.0.2.1")),
+        batcher.upsert("Z1", a_record("www.example.com", "192.0.2.2")),
+        batcher.upsert("Z2", a_record("example.org", "192.0.2.1")),
+    )
+
+    assert len(agent.batches) == 2
+    zone, changes = agent.batches[0]
+    assert zone == "Z1"
+    assert len(changes) == 2
+    assert changes[1]['ResourceRecordSet']['ResourceRecords'] == [{'Value': "192.0.2.2"}]
+    assert change_ids[:3] == ["/change/1"] * 3
+    assert change_ids[3] == "/change/2"
+
+@pytest.mark.asyncio
+async def test_changes_split_within_limits():
+    agent = FakeAgent()
+    batcher = ZoneChangeBatcher(agent, 0.01)
+
+    await asyncio.gather(*[batcher.upsert("Z1", a_record(f"h{i}.example.com", "192.0.2.1")) for i in range(600)])
+
+    assert [len(changes) for zone, changes in agent.batches] == [500, 100]
+
+@pytest.mark.asyncio
+async def test_sent_changes_update_zone_snapshot():
+    agent = FakeAgent()
+    batcher = ZoneChangeBatcher(agent, 0.01)
+    wanted = [a_record("example.com.", "192.0.2.1"), a_record("www.example.com.", "192.0.2.1")]
+
+    changes, extra = await agent.records.diff("Z1", wanted)
+    assert len(changes) == 2
+    assert extra == []
+
+    await asyncio.gather(*[batcher.upsert("Z1", x['ResourceRecordSet']) for x in changes])
+
+    changes, extra = await agent.records.diff("Z1", wanted)
+    assert changes == []
+    assert agent.records.metrics()['zone_fetches'] == 1
@@ -0,0 +1,29 @@
+import pytest
+
+import asyncio
+
+from sdmgr.dns_provider.route53.poller import ChangePoller
+
+
+class FakeAgent:
+    def __init__(self, polls_until_insync):
+        self.polls_until_insync = polls_until_insync
+        self.polls = {}
+
+    async def _call(self, method, Id):
+        self.polls[Id] = self.polls.get(Id, 0) + 1
+        status = "INSYNC" if self.polls[Id] >= self.polls_until_insync else "PENDING"
+        return {"ChangeInfo": {"Id": Id, "Status": status}}
+
+
+@pytest.mark.asyncio
+async def test_poller_shares_polls_between_waiters():
+    agent = FakeAgent(3)
+    poller = ChangePoller(agent, 0.01, 0.02)
+
+    await asyncio.gather(*[poller.wait("/change/1") for i in range(5)], poller.wait("/change/2"))
+
+    assert agent.polls == {"/change/1": 3, "/change/2": 3}
+    metrics = poller.metrics()
+    assert metrics['polled_changes'] == 0
+    assert metrics['completed_changes'] == 2
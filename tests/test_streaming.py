@@ -0,0 +1,71 @@
+import pytest
+
+import json
+import os
+
+from sdmgr.registrar.streaming import iter_bytes, iter_csv_rows, iter_lines, iter_batches, iter_json_array_items
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+async def iter_chunks(content, size):
+    for i in range(0, len(content), size):
+        yield content[i:i + size]
+
+async def collect(items):
+    return [x async for x in items]
+
+
+@pytest.mark.asyncio
+async def test_lines_split_on_any_line_ending():
+    content = "one\r\ntwo\rthree\nfour".encode("utf8")
+    for size in range(1, 6):
+        assert await collect(iter_lines(iter_chunks(content, size))) == ["one", "two", "three", "four"]
+
+@pytest.mark.asyncio
+async def test_marcaria_export_rows_streamed():
+    with open(os.path.join(DATA_DIR, "marcaria-export.csv"), "rb") as f:
+        content = f.read()
+
+    rows = await collect(iter_csv_rows(iter_chunks(content, 7)))
+    assert rows == await collect(iter_csv_rows(iter_bytes(content.replace(b"\n", b"\r"))))
+
+    # BOM is dropped from the header
+    assert rows[0][0] == "Domain"
+    assert rows[1][0] == "marcaria1.test"
+    assert rows[1][5] == "Test Company Limited"
+
+@pytest.mark.asyncio
+async def test_csv_quoted_field_over_several_lines():
+    content = 'a,b,c\r\nx,"multi\r\n\r\n""line""",y\r\nz,,w\r\n'.encode("utf8")
+    for size in (1, 4, 100):
+        assert await collect(iter_csv_rows(iter_chunks(content, size))) == [
+            ["a", "b", "c"],
+            ["x", 'multi\n\n"line"', "y"],
+            ["z", "", "w"],
+        ]
+
+@pytest.mark.asyncio
+async def test_items_grouped_into_batches():
+    async def items():
+        for i in range(5):
+            yield i
+
+    assert await collect(iter_batches(items(), 2)) == [[0, 1], [2, 3], [4]]
+
+@pytest.mark.asyncio
+async def test_json_array_items_streamed():
+    domains = [{"name": f"ionos{i}.test", "state": "ACTIVE", "tags": ["a", "]"]} for i in range(3)]
+    content = json.dumps({"count": {"domainList": []}, "domainList": domains, "total": 3}).encode("utf8")
+    for size in (1, 5, 64):
+        assert await collect(iter_json_array_items(iter_chunks(content, size), "domainList")) == domains
+
+    with pytest.raises(ValueError):
+        await collect(iter_json_array_items(iter_bytes(b'{"domains": []}'), "domainList"))
+
+@pytest.mark.asyncio
+async def test_json_array_scalars_split_across_chunks():
+    items = [12345, 6, 1.5e3, True, None, "7", -0.25]
+    content = json.dumps({"domainList": items}).encode("utf8")
+    for size in (1, 2, 3):
+        assert await collect(iter_json_array_items(iter_chunks(content, size), "domainList")) == items